@@ -0,0 +1,87 @@
+"""Per-message cost of resolving XP modifiers.
+
+Run from the repository root:
+
+    python -m benchmarks.modifiers --entries 500 --roles 40
+"""
+
+from argparse import ArgumentParser
+from random import Random
+from timeit import Timer
+
+from helpers.modifiers import ModifierResolver
+
+
+def legacy(modifiers: dict, user: int, channel: int, category: int, roles: list):
+    """The modifier lookup as it was done before modifiers were compiled."""
+    modifiers = {int(k): v for k, v in modifiers.items()}
+    overall = 1
+
+    usermod = modifiers.get(user)
+    if usermod == 0:
+        return 0
+    elif usermod:
+        overall = usermod
+
+    channelmod = modifiers.get(channel)
+    if channelmod == 0:
+        return 0
+    elif channelmod:
+        overall = channelmod
+
+    catmod = modifiers.get(category)
+    if catmod == 0:
+        return 0
+    elif catmod:
+        overall = catmod
+
+    role_overall = 0
+    for role in roles:
+        rolemod = modifiers.get(role)
+        if rolemod is None:
+            continue
+        if rolemod == 0:
+            return 0
+        elif rolemod > role_overall:
+            role_overall = rolemod
+
+    return overall
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--roles", type=int, default=40, help="roles per author")
+    parser.add_argument("--number", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = Random(args.seed)
+    snowflake = lambda: rng.randrange(10**17, 10**18)
+
+    # Split the entries evenly over the four target types, values are never 0
+    # so every lookup has to run to completion
+    tables = [{}, {}, {}, {}]
+    for i in range(args.entries):
+        tables[i % 4][snowflake()] = rng.choice([0.5, 1.5, 2, 3])
+    users, channels, categories, roles = tables
+
+    raw = {str(k): v for table in tables for k, v in table.items()}
+    resolver = ModifierResolver(users, channels, categories, roles)
+
+    role_pool = list(roles) + [snowflake() for _ in range(args.roles)]
+    author_roles = sorted(rng.sample(role_pool, min(args.roles, len(role_pool))))
+    message = (snowflake(), snowflake(), next(iter(categories), None), author_roles)
+
+    print(f"{args.entries} modifier entries, {len(author_roles)} author roles")
+
+    for name, stmt in (
+        ("legacy", lambda: legacy(raw, *message)),
+        ("compiled", lambda: resolver.resolve(*message)),
+    ):
+        best = min(Timer(stmt).repeat(repeat=5, number=args.number))
+        print(f"{name:>10}: {best / args.number * 1e9:10.0f} ns/message")
+
+
+if __name__ == "__main__":
+    main()
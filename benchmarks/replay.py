@@ -0,0 +1,298 @@
+"""Throughput and latency of the XP pipeline over a synthetic message stream.
+
+Run from the repository root:
+
+    python -m benchmarks.replay --messages 100000 --backend memory
+
+The memory backend journals to a temporary directory. The postgres backend
+connects using the same DB_* environment variables as the bot, creates its
+synthetic guilds and removes them again afterwards.
+"""
+
+from argparse import ArgumentParser
+from asyncio import run, sleep
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from discord import CategoryChannel
+
+from helpers.tracing import Profiler, Tracer
+from source.cogs.listener import Listener
+from source.utils.database import Database
+from source.utils.scheduler import RESTScheduler
+from source.utils.memory import MemoryDatabase
+
+
+class FakeChannel:
+    def __init__(self, id: int, category_id: Optional[int]):
+        self.id = id
+        self.category_id = category_id
+
+    async def send(self, content: str):
+        pass
+
+
+class FakeMember:
+    def __init__(self, id: int, roles: List[int]):
+        self.id = id
+        self.bot = False
+        self._roles = sorted(roles)
+        self.mention = f"<@{id}>"
+
+    async def edit(self, roles: list):
+        self._roles = sorted(role.id for role in roles)
+
+    async def send(self, content: str):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, id: int, roles: List[int], channels: Dict[int, object]):
+        self.id = id
+        self.roles = set(roles)
+        self.channels = channels
+
+    def get_role(self, id: int) -> Optional[int]:
+        return id if id in self.roles else None
+
+    def get_channel(self, id: int):
+        return self.channels.get(id)
+
+    def __str__(self) -> str:
+        return f"Guild {self.id}"
+
+
+class FakeMessage:
+    __slots__ = ("guild", "author", "channel", "content")
+
+    def __init__(self, guild, author, channel, content: str):
+        self.guild = guild
+        self.author = author
+        self.channel = channel
+        self.content = content
+
+    async def add_reaction(self, emoji: str):
+        pass
+
+    async def delete(self):
+        pass
+
+
+class FakeUser:
+    id = 1
+
+
+class FakeBot:
+    """Just enough of Bot for the listener to run."""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.user = FakeUser()
+        self.tracer = Tracer()
+        self.profiler = Profiler()
+        self.scheduler = RESTScheduler()
+
+    async def wait_until_ready(self):
+        pass
+
+
+class CountingMemoryDatabase(MemoryDatabase):
+    """The memory backend, counting the calls which are round trips on Postgres."""
+
+    def __init__(self):
+        super().__init__()
+        self.round_trips = 0
+
+    async def fetch_user(self, id: int, guild_id: int, usecache: bool = True):
+        self.round_trips += 1
+        return await super().fetch_user(id, guild_id, usecache)
+
+    async def flush_xp(self, batch: dict):
+        self.round_trips += 1
+        await super().flush_xp(batch)
+
+
+class CountingPool:
+    """Counts connections checked out of a pool, each is at least one round trip."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.round_trips = 0
+
+    def acquire(self):
+        self.round_trips += 1
+        return self.pool.acquire()
+
+    def __getattr__(self, name: str):
+        return getattr(self.pool, name)
+
+
+def generate(args) -> Tuple[Dict[int, dict], List[FakeMessage]]:
+    """Generate guilds with their configs, and a stream of messages in them."""
+    rng = Random(args.seed)
+    snowflake = lambda: rng.randrange(10**17, 10**18)
+
+    configs = {}
+    streams = []
+
+    for _ in range(args.guilds):
+        guild_id = snowflake()
+        roles = [snowflake() for _ in range(args.roles)]
+
+        categories = {}
+        for _ in range(max(args.channels // 5, 1)):
+            category = CategoryChannel.__new__(CategoryChannel)
+            category.id = snowflake()
+            categories[category.id] = category
+
+        channels = {}
+        for _ in range(args.channels):
+            channel = FakeChannel(snowflake(), rng.choice([None, *categories]))
+            channels[channel.id] = channel
+
+        guild = FakeGuild(guild_id, roles, {**channels, **categories})
+        members = [
+            FakeMember(snowflake(), rng.sample(roles, rng.randint(0, len(roles))))
+            for _ in range(args.members)
+        ]
+
+        # A few modifiers of every kind, and level roles for the first roles
+        modifiers = {}
+        for targets in (members, list(channels.values()), list(categories.values())):
+            for target in rng.sample(targets, min(len(targets), 3)):
+                modifiers[str(target.id)] = rng.choice([0.5, 1.5, 2])
+        for role in rng.sample(roles, min(len(roles), 5)):
+            modifiers[str(role)] = rng.choice([0.5, 1.5, 2])
+
+        configs[guild_id] = {
+            "cooldown": args.cooldown,
+            "modifiers": modifiers,
+            "roles": {str(level * 5): role for level, role in enumerate(roles[:10])},
+            "levelup": {"method": "react"},
+        }
+
+        # Activity is skewed so a few members send most messages
+        weights = [1 / (rank + 1) for rank in range(len(members))]
+        streams.append((guild, members, weights, list(channels.values())))
+
+    messages = []
+    guild_weights = [1 / (rank + 1) for rank in range(len(streams))]
+    for _ in range(args.messages):
+        guild, members, weights, channels = rng.choices(streams, guild_weights)[0]
+        author = rng.choices(members, weights)[0]
+        messages.append(FakeMessage(guild, author, rng.choice(channels), "hello"))
+
+    return configs, messages
+
+
+async def replay(
+    args, configs: Dict[int, dict], messages: List[FakeMessage], directory: str
+):
+    """Run every message through the listener, returning per message latencies."""
+    if args.backend == "postgres":
+        db = Database()
+        await db.setup()
+        db.pool = counter = CountingPool(db.pool)
+    else:
+        db = counter = CountingMemoryDatabase()
+        db.path = Path(directory)
+        await db.setup()
+
+    bot = FakeBot(db)
+    bot.scheduler.start()
+    listener = Listener(bot)
+    listener.debugging = False
+    await listener.on_ready()
+
+    try:
+        for guild_id, config in configs.items():
+            await db.create_guild(guild_id, "!", config)
+
+        trips = counter.round_trips
+        latencies = []
+
+        start = perf_counter()
+        for message in messages:
+            before = perf_counter()
+            await listener.on_message(message)
+            latencies.append(perf_counter() - before)
+
+        # Let queued REST jobs run, then write out everything still buffered
+        while len(bot.scheduler):
+            await sleep(0)
+        await db.buffer.flush()
+        elapsed = perf_counter() - start
+
+        return elapsed, latencies, counter.round_trips - trips
+    finally:
+        await bot.scheduler.close()
+        if args.backend == "postgres":
+            for guild_id in configs:
+                await db.clear_guild(guild_id)
+                await db.execute("DELETE FROM Guilds WHERE id = $1;", guild_id)
+        await db.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=500, help="members per guild")
+    parser.add_argument("--roles", type=int, default=30, help="roles per guild")
+    parser.add_argument("--channels", type=int, default=20, help="channels per guild")
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument(
+        "--cooldown", type=int, default=0, help="0 runs every message in full"
+    )
+    parser.add_argument(
+        "--allocations",
+        type=int,
+        default=10_000,
+        help="messages to replay again under tracemalloc",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    load_dotenv()
+    configs, messages = generate(args)
+
+    print(
+        f"{args.guilds} guilds, {args.members} members, {args.roles} roles, "
+        f"{args.channels} channels, {len(messages)} messages, {args.backend} backend"
+    )
+
+    with TemporaryDirectory() as directory:
+        elapsed, latencies, trips = run(replay(args, configs, messages, directory))
+    latencies.sort()
+    percentile = lambda p: latencies[
+        min(int(len(latencies) * p / 100), len(latencies) - 1)
+    ]
+
+    print(f"{'throughput':>12}: {len(messages) / elapsed:10.0f} messages/s")
+    print(f"{'p50':>12}: {percentile(50) * 1e6:10.1f} us")
+    print(f"{'p99':>12}: {percentile(99) * 1e6:10.1f} us")
+    print(
+        f"{'round trips':>12}: {trips / len(messages):10.4f} /message ({trips} total)"
+    )
+
+    # Tracing slows everything down, so it gets a separate, shorter run
+    if args.allocations:
+        tracemalloc.start()
+        with TemporaryDirectory() as directory:
+            run(replay(args, configs, messages[: args.allocations], directory))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"{'allocations':>12}: {current / args.allocations:10.1f} bytes/message "
+            f"retained, {peak / 1024:.0f} KiB peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
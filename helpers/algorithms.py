@@ -1,5 +1,8 @@
 from typing import Tuple
-from math import sqrt
+from math import isqrt
+
+# Above this the batch APIs fall back to Python ints so int64 can't overflow
+BATCH_MAX_XP = 2**59
 
 
 class Algorithm:
@@ -13,6 +16,19 @@ class Algorithm:
 
         return al, nx, al > bl
 
+    @classmethod
+    def get_levels(cls, xp, inc: int) -> tuple:
+        """Returns arrays of the levels and xp required to level up for an array of xp."""
+        import numpy as np
+
+        xp = np.asarray(xp, dtype=object if _too_large(xp) else np.int64)
+
+        if xp.dtype == object:
+            levels, required = np.frompyfunc(cls.get_level, 2, 2)(xp, inc)
+            return levels, required
+
+        return cls._get_levels(xp, inc)
+
 
 class Linear(Algorithm):
     """A fully linear levelling algorithm."""
@@ -21,14 +37,42 @@ class Linear(Algorithm):
     def get_level(xp: int, inc: int) -> tuple:
         return xp // inc, inc - (xp % inc)
 
+    @staticmethod
+    def _get_levels(xp, inc: int) -> tuple:
+        import numpy as np
+
+        levels, remainder = np.divmod(xp, inc)
+        return levels, inc - remainder
+
 
 class Quadratic(Algorithm):
     """A ^0.5 based levelling algorithm."""
 
     @staticmethod
     def get_level(xp: int, thr: int) -> tuple:
-        level = int((1 + sqrt(1 + 8 * (xp / thr))) / 2)
+        level = (1 + isqrt(1 + 8 * xp // thr)) // 2
+
+        return level, thr * level * (level + 1) // 2 - xp
+
+    @staticmethod
+    def _get_levels(xp, thr: int) -> tuple:
+        import numpy as np
+
+        # 8 * xp // thr, without overflowing on 8 * xp
+        quotient, remainder = np.divmod(xp, thr)
+        n = 1 + 8 * quotient + 8 * remainder // thr
+
+        # The float sqrt can be off by one either way, so correct it to isqrt
+        root = np.sqrt(n.astype(np.float64)).astype(np.int64)
+        root -= root * root > n
+        root += (root + 1) * (root + 1) <= n
+
+        levels = (1 + root) // 2
+        return levels, thr * levels * (levels + 1) // 2 - xp
+
 
-        x = ((level + 1) ** 2 * thr - (level + 1) * thr) * 0.5
+def _too_large(xp) -> bool:
+    import numpy as np
 
-        return level, int(x - xp)
+    xp = np.asarray(xp)
+    return xp.size > 0 and (xp.dtype == object or int(xp.max()) >= BATCH_MAX_XP)
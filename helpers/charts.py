@@ -0,0 +1,25 @@
+from io import BytesIO
+
+from helpers.curves import Curve
+
+
+def render_breakdown(curve: Curve) -> bytes:
+    """Render the level breakdown chart for a curve as PNG bytes.
+
+    This is run in a worker process, so matplotlib is only imported there.
+    """
+    import numpy as np
+    from matplotlib.figure import Figure
+
+    xpt = np.arange(100) * 1000
+    level, _ = curve.get_levels(xpt)
+
+    figure = Figure()
+    axes = figure.subplots()
+    axes.plot(xpt, level)
+    axes.set_xlabel("XP")
+    axes.set_ylabel("Level")
+
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
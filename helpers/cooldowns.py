@@ -0,0 +1,74 @@
+from math import ceil
+from time import monotonic
+from typing import Dict, List, Optional
+
+
+class CooldownStore:
+    """Per-member cooldowns which are dropped as soon as they expire.
+
+    Expiries are hashed into a timing wheel with one-second slots, so each
+    entry is evicted exactly once, in amortised O(1), by whichever check
+    first runs after its slot has passed.
+    """
+
+    def __init__(self):
+        # (user_id << 64 | guild_id) -> monotonic expiry time
+        self.expiries: Dict[int, float] = {}
+        # second -> keys whose expiry falls within that second
+        self.slots: Dict[int, List[int]] = {}
+        self.cursor = int(monotonic())
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.expiries)
+
+    def hit(
+        self, user_id: int, guild_id: int, cooldown: float, now: Optional[float] = None
+    ) -> bool:
+        """Get whether a member is on cooldown, starting a new one if they aren't."""
+        if now is None:
+            now = monotonic()
+        self.expire(now)
+
+        key = user_id << 64 | guild_id
+        expiry = self.expiries.get(key)
+        if expiry is not None and expiry > now:
+            return True
+
+        self.expiries[key] = expiry = now + cooldown
+
+        slot = ceil(expiry)
+        keys = self.slots.get(slot)
+        if keys is None:
+            self.slots[slot] = [key]
+        else:
+            keys.append(key)
+
+        return False
+
+    def expire(self, now: float) -> None:
+        """Drop every cooldown which has expired by `now`."""
+        second = int(now)
+        if second <= self.cursor:
+            return
+
+        # After a long idle period it's cheaper to check the occupied slots
+        # than to step through every second that has passed
+        if second - self.cursor > len(self.slots):
+            slots = [slot for slot in self.slots if slot <= second]
+        else:
+            slots = range(self.cursor + 1, second + 1)
+        self.cursor = second
+
+        expiries = self.expiries
+        for slot in slots:
+            keys = self.slots.pop(slot, None)
+            if keys is None:
+                continue
+
+            for key in keys:
+                # The key may have been given a later expiry since it was slotted
+                expiry = expiries.get(key)
+                if expiry is not None and expiry <= now:
+                    del expiries[key]
+                    self.evictions += 1
@@ -0,0 +1,189 @@
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, List, Tuple, Type
+
+from helpers.algorithms import BATCH_MAX_XP, Algorithm, Linear, Quadratic, _too_large
+
+# Each level of the exponential curve costs this much more than the last
+GROWTH = 1.1
+
+# Levels past this cost the same as the last, so tables stay a bounded size
+MAX_LEVEL = 10_000
+
+# The most a single level of a custom curve can cost
+MAX_COST = 10**9
+
+
+class Curve:
+    """A levelling curve, bound to a guild's increment."""
+
+    key: Hashable
+
+    def get_level(self, xp: int) -> Tuple[int, int]:
+        """Returns the level and xp required to level up."""
+        raise NotImplementedError
+
+    def get_levels(self, xp) -> tuple:
+        """Returns arrays of the levels and xp required to level up for an array of xp."""
+        raise NotImplementedError
+
+    def calc(self, before: int, after: int) -> Tuple[int, int, bool]:
+        """Returns the level, xp required to level up, whether the current xp gain is a levelup."""
+        bl, _ = self.get_level(before)
+        al, nx = self.get_level(after)
+
+        return al, nx, al > bl
+
+
+class AlgorithmCurve(Curve):
+    """A curve with a closed form level calculation."""
+
+    def __init__(self, name: str, algorithm: Type[Algorithm], inc: int):
+        self.key = (name, inc)
+        self.algorithm = algorithm
+        self.inc = inc
+
+    def get_level(self, xp: int) -> Tuple[int, int]:
+        return self.algorithm.get_level(xp, self.inc)
+
+    def get_levels(self, xp) -> tuple:
+        return self.algorithm.get_levels(xp, self.inc)
+
+
+class TableCurve(Curve):
+    """A curve compiled into a table of the total xp needed for each level.
+
+    The table is extended as higher levels are reached, so only levels
+    someone actually has are ever computed. Past `limit` levels every level
+    costs the same as the last one in the table.
+    """
+
+    limit = MAX_LEVEL
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.thresholds: List[int] = [0]
+
+    def cost(self, level: int) -> int:
+        """Get the xp needed to go from a level to the next."""
+        raise NotImplementedError
+
+    def extend(self, xp: int) -> None:
+        """Compute thresholds until the last one is above the given xp, or the limit."""
+        thresholds = self.thresholds
+        while thresholds[-1] <= xp and len(thresholds) <= self.limit:
+            level = len(thresholds) - 1
+            thresholds.append(thresholds[-1] + max(self.cost(level), 1))
+
+    @property
+    def tail(self) -> int:
+        """The cost of each level past the end of the table."""
+        return max(self.cost(len(self.thresholds) - 1), 1)
+
+    def threshold(self, level: int) -> int:
+        """Get the total xp needed to reach a level."""
+        last = len(self.thresholds) - 1
+        if level <= last:
+            return self.thresholds[level]
+
+        return self.thresholds[last] + (level - last) * self.tail
+
+    def get_level(self, xp: int) -> Tuple[int, int]:
+        self.extend(xp)
+        thresholds = self.thresholds
+
+        if xp < thresholds[-1]:
+            level = bisect_right(thresholds, xp) - 1
+            return level, thresholds[level + 1] - xp
+
+        levels, remainder = divmod(xp - thresholds[-1], self.tail)
+        return len(thresholds) - 1 + levels, self.tail - remainder
+
+    def get_levels(self, xp) -> tuple:
+        import numpy as np
+
+        if _too_large(xp):
+            return np.frompyfunc(self.get_level, 1, 2)(np.asarray(xp, dtype=object))
+
+        xp = np.asarray(xp, dtype=np.int64)
+        if xp.size:
+            self.extend(int(xp.max()))
+
+        # Huge step costs put the table itself out of int64's range
+        if self.thresholds[-1] >= BATCH_MAX_XP or self.tail >= BATCH_MAX_XP:
+            return np.frompyfunc(self.get_level, 1, 2)(xp.astype(object))
+
+        thresholds = np.asarray(self.thresholds, dtype=np.int64)
+        last, tail = len(thresholds) - 1, self.tail
+
+        # Clipped so that xp past the table doesn't index past its end
+        levels = np.minimum(np.searchsorted(thresholds, xp, side="right") - 1, last - 1)
+        required = thresholds[levels + 1] - xp
+
+        beyond = xp >= thresholds[last]
+        extra, remainder = np.divmod(xp - thresholds[last], tail)
+        return (
+            np.where(beyond, last + extra, levels),
+            np.where(beyond, tail - remainder, required),
+        )
+
+    def calc(self, before: int, after: int) -> Tuple[int, int, bool]:
+        al, nx = self.get_level(after)
+
+        # Only a levelup if the new level starts above the previous xp
+        return al, nx, before < self.threshold(al)
+
+
+class Exponential(TableCurve):
+    """Each level costs a fixed percentage more than the last."""
+
+    def __init__(self, inc: int):
+        super().__init__(("exponential", inc))
+        self.inc = inc
+
+    def cost(self, level: int) -> int:
+        return int(self.inc * GROWTH**level)
+
+
+class MEE6(TableCurve):
+    """The same curve as MEE6, so imported levels match."""
+
+    def __init__(self):
+        super().__init__(("mee6",))
+
+    def cost(self, level: int) -> int:
+        return 5 * level**2 + 50 * level + 100
+
+
+class Piecewise(TableCurve):
+    """A custom curve of (level, cost) steps, each level costs the latest step's cost."""
+
+    def __init__(self, steps: Tuple[Tuple[int, int], ...], inc: int):
+        super().__init__(("piecewise", steps, inc))
+        self.levels = [level for level, _ in steps]
+        self.costs = [cost for _, cost in steps]
+        self.inc = inc
+
+        # Levels after the last step all cost the same
+        self.limit = min(self.levels[-1] + 1 if steps else 1, MAX_LEVEL)
+
+    def cost(self, level: int) -> int:
+        if not self.costs:
+            return self.inc
+
+        return self.costs[max(bisect_right(self.levels, level) - 1, 0)]
+
+
+curves: Dict[str, Callable[[int, Tuple[Tuple[int, int], ...]], Curve]] = {
+    "linear": lambda inc, steps: AlgorithmCurve("linear", Linear, inc),
+    "quadratic": lambda inc, steps: AlgorithmCurve("quadratic", Quadratic, inc),
+    "exponential": lambda inc, steps: Exponential(inc),
+    "mee6": lambda inc, steps: MEE6(),
+    "piecewise": lambda inc, steps: Piecewise(steps, inc),
+}
+
+
+@lru_cache(maxsize=1024)
+def get_curve(name: str, inc: int, steps: Tuple[Tuple[int, int], ...] = ()) -> Curve:
+    """Get a compiled curve, guilds with the same curve share its tables."""
+    return curves[name](inc, steps)
@@ -0,0 +1,61 @@
+from itertools import count
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Shared between instances so a reloaded leaderboard never reuses a version
+_versions = count(1)
+
+
+class TopK:
+    """The top K members of a guild by XP, kept up to date as XP is gained.
+
+    This relies on XP only ever going up; anything which lowers XP has to
+    rebuild the leaderboard from the database.
+    """
+
+    def __init__(self, size: int, rows: Iterable[Tuple[int, int]]):
+        self.size = size
+        self.entries: Dict[int, int] = dict(rows)
+        self.version = next(_versions)
+
+        self._floor: Optional[Tuple[int, int]] = None
+        self._ordered: Optional[List[Tuple[int, int]]] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def floor(self) -> Tuple[int, int]:
+        """The (xp, id) of the lowest entry."""
+        if self._floor is None:
+            self._floor = min((xp, id) for id, xp in self.entries.items())
+        return self._floor
+
+    def set(self, id: int, xp: int) -> None:
+        """Set a member's total XP, adding them if they beat the lowest entry."""
+        if id in self.entries:
+            if self.entries[id] == xp:
+                return
+            self.entries[id] = xp
+            if self._floor and self._floor[1] == id:
+                self._floor = None
+        elif len(self.entries) < self.size:
+            self.entries[id] = xp
+            if self._floor and (xp, id) < self._floor:
+                self._floor = (xp, id)
+        else:
+            if (xp, id) <= self.floor:
+                return
+            del self.entries[self.floor[1]]
+            self.entries[id] = xp
+            self._floor = None
+
+        self._ordered = None
+        self.version = next(_versions)
+
+    def top(self) -> List[Tuple[int, int]]:
+        """Get the (id, xp) of every entry, highest first."""
+        if self._ordered is None:
+            self._ordered = sorted(
+                self.entries.items(), key=lambda entry: (-entry[1], entry[0])
+            )
+        return self._ordered
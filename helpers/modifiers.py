@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, Optional, Union
+
+Number = Union[int, float]
+
+
+class ModifierResolver:
+    """A guild's XP modifiers compiled into one lookup table per target type.
+
+    Precedence is user, then channel, then category, then the highest role
+    modifier the author has. If any modifier which applies to the message is
+    explicitly 0, the overall modifier is 0.
+    """
+
+    __slots__ = ("users", "channels", "categories", "roles")
+
+    def __init__(
+        self,
+        users: Dict[int, Number],
+        channels: Dict[int, Number],
+        categories: Dict[int, Number],
+        roles: Dict[int, Number],
+    ):
+        self.users = users
+        self.channels = channels
+        self.categories = categories
+        self.roles = roles
+
+    def __len__(self) -> int:
+        return (
+            len(self.users)
+            + len(self.channels)
+            + len(self.categories)
+            + len(self.roles)
+        )
+
+    def resolve(
+        self,
+        user_id: int,
+        channel_id: int,
+        category_id: Optional[int],
+        role_ids: Iterable[int],
+    ) -> Number:
+        """Get the overall modifier for a message."""
+        user = self.users.get(user_id)
+        if user == 0:
+            return 0
+
+        channel = self.channels.get(channel_id)
+        if channel == 0:
+            return 0
+
+        category = self.categories.get(category_id)
+        if category == 0:
+            return 0
+
+        role = None
+        if self.roles:
+            roles = self.roles
+            for role_id in role_ids:
+                value = roles.get(role_id)
+                if value is None:
+                    continue
+                if value == 0:
+                    return 0
+                if role is None or value > role:
+                    role = value
+
+        if user is not None:
+            return user
+        if channel is not None:
+            return channel
+        if category is not None:
+            return category
+        if role is not None:
+            return role
+        return 1
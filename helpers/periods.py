@@ -0,0 +1,32 @@
+from datetime import date, timedelta
+
+# Windowed XP is bucketed by the UTC week (starting Monday) or month it's gained in
+PERIODS = ("weekly", "monthly")
+
+
+def period_start(kind: str, day: date) -> date:
+    """Get the first day of the period a day is in."""
+    if kind == "weekly":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_period(kind: str, start: date) -> date:
+    """Get the first day of the period after the one starting on `start`."""
+    if kind == "weekly":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def previous_period(kind: str, start: date) -> date:
+    """Get the first day of the period before the one starting on `start`."""
+    if kind == "weekly":
+        return start - timedelta(days=7)
+    return (start - timedelta(days=1)).replace(day=1)
+
+
+def retention_cutoff(kind: str, start: date, keep: int) -> date:
+    """Get the first day of the oldest period to keep, keeping `keep` past periods."""
+    for _ in range(keep):
+        start = previous_period(kind, start)
+    return start
@@ -0,0 +1,198 @@
+from math import inf, log2
+from random import random
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value: Any, height: int):
+        self.value = value
+        self.next: List["_Node"] = [None] * height
+        # Number of bottom level steps to the next node at each level
+        self.width: List[int] = [0] * height
+
+
+class SortedSkiplist:
+    """A sorted sequence with O(log n) insert, remove, bisect and indexing."""
+
+    LEVELS = 32
+
+    def __init__(self):
+        self.size = 0
+        self.tail = _Node((inf,), 0)
+        self.head = _Node(None, self.LEVELS)
+        self.head.next = [self.tail] * self.LEVELS
+        self.head.width = [1] * self.LEVELS
+
+    def __len__(self) -> int:
+        return self.size
+
+    @classmethod
+    def height(cls) -> int:
+        return min(cls.LEVELS, 1 - int(log2(1 - random())))
+
+    @classmethod
+    def from_sorted(cls, values: Iterable) -> "SortedSkiplist":
+        """Build a skiplist from already sorted values in O(n)."""
+        self = cls()
+        last = [self.head] * self.LEVELS
+        positions = [0] * self.LEVELS
+
+        position = 0
+        for value in values:
+            position += 1
+            node = _Node(value, self.height())
+
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - positions[level]
+                last[level] = node
+                positions[level] = position
+
+        for level in range(self.LEVELS):
+            last[level].next[level] = self.tail
+            last[level].width[level] = position + 1 - positions[level]
+
+        self.size = position
+        return self
+
+    def __getitem__(self, index: int) -> Any:
+        if not 0 <= index < self.size:
+            raise IndexError("skiplist index out of range")
+
+        node = self.head
+        index += 1
+        for level in reversed(range(self.LEVELS)):
+            while node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+
+        return node.value
+
+    def bisect_left(self, value: Any) -> int:
+        """Get the number of values less than the given value."""
+        node = self.head
+        index = 0
+        for level in reversed(range(self.LEVELS)):
+            while node.next[level].value < value:
+                index += node.width[level]
+                node = node.next[level]
+
+        return index
+
+    def insert(self, value: Any) -> None:
+        chain = [None] * self.LEVELS
+        steps = [0] * self.LEVELS
+
+        node = self.head
+        for level in reversed(range(self.LEVELS)):
+            while node.next[level].value <= value:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new = _Node(value, self.height())
+        distance = 0
+        for level in range(len(new.next)):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - distance
+            previous.width[level] = distance + 1
+            distance += steps[level]
+
+        for level in range(len(new.next), self.LEVELS):
+            chain[level].width[level] += 1
+
+        self.size += 1
+
+    def remove(self, value: Any) -> None:
+        chain = [None] * self.LEVELS
+
+        node = self.head
+        for level in reversed(range(self.LEVELS)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target.value != value:
+            raise KeyError(value)
+
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+
+        for level in range(len(target.next), self.LEVELS):
+            chain[level].width[level] -= 1
+
+        self.size -= 1
+
+
+class RankIndex:
+    """An order-statistic index of a guild's members by XP."""
+
+    def __init__(self):
+        self.xp = {}
+        # Sorted (-xp, id) pairs, so position 0 is the top of the guild
+        self.entries = SortedSkiplist()
+
+    def __len__(self) -> int:
+        return len(self.xp)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, int]]) -> "RankIndex":
+        """Build an index from (id, xp) rows."""
+        self = cls()
+        self.xp = {id: xp for id, xp in rows}
+        self.entries = SortedSkiplist.from_sorted(
+            sorted((-xp, id) for id, xp in self.xp.items())
+        )
+        return self
+
+    def set(self, id: int, xp: int) -> None:
+        """Set a member's total XP."""
+        old = self.xp.get(id)
+        if old == xp:
+            return
+
+        if old is not None:
+            self.entries.remove((-old, id))
+
+        self.xp[id] = xp
+        self.entries.insert((-xp, id))
+
+    def remove(self, id: int) -> None:
+        old = self.xp.pop(id, None)
+        if old is not None:
+            self.entries.remove((-old, id))
+
+    def rank(self, id: int) -> Optional[int]:
+        """Get a member's rank, members with equal XP share a rank."""
+        xp = self.xp.get(id)
+        if xp is None:
+            return None
+
+        # Ids are never negative, so this counts everyone with more XP
+        return self.entries.bisect_left((-xp, -1)) + 1
+
+    def at(self, position: int) -> Tuple[int, int]:
+        """Get the (id, xp) of the member at a 0-indexed position."""
+        xp, id = self.entries[position]
+        return id, -xp
+
+    def neighbours(
+        self, id: int, count: int = 1
+    ) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+        """Get the (id, xp) of up to `count` members directly above and below."""
+        xp = self.xp.get(id)
+        if xp is None:
+            return [], []
+
+        position = self.entries.bisect_left((-xp, id))
+        above = range(max(position - count, 0), position)
+        below = range(position + 1, min(position + 1 + count, len(self.entries)))
+
+        return [self.at(i) for i in above], [self.at(i) for i in below]
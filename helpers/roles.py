@@ -0,0 +1,41 @@
+from bisect import bisect_right
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+
+class LevelRoles:
+    """A guild's level roles compiled into a sorted threshold array."""
+
+    __slots__ = ("levels", "roles", "all", "_targets")
+
+    def __init__(self, roles: Mapping[int, int]):
+        ordered = sorted(roles.items())
+
+        self.levels: List[int] = [level for level, _ in ordered]
+        self.roles: List[int] = [role for _, role in ordered]
+        self.all: FrozenSet[int] = frozenset(self.roles)
+
+        # threshold index -> roles a member at that index should have
+        self._targets: Dict[int, FrozenSet[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def target(self, level: int) -> FrozenSet[int]:
+        """Get the set of level roles a member at the given level should have."""
+        index = bisect_right(self.levels, level)
+
+        try:
+            return self._targets[index]
+        except KeyError:
+            target = self._targets[index] = frozenset(self.roles[:index])
+            return target
+
+    def reconcile(self, current: Iterable[int], level: int) -> Optional[List[int]]:
+        """Get a member's full new role list, or None if it doesn't need to change."""
+        current = list(current)
+        target = self.target(level)
+
+        if self.all.intersection(current) == target:
+            return None
+
+        return [role for role in current if role not in self.all] + list(target)
@@ -0,0 +1,157 @@
+from asyncio import Future, get_event_loop
+from cProfile import Profile
+from collections import defaultdict
+from contextlib import contextmanager
+from io import StringIO
+from pstats import Stats
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+
+
+class Histogram:
+    """A latency histogram with power of two microsecond buckets."""
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * 40
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.buckets[min(int(seconds * 1_000_000).bit_length(), 39)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """Get the upper bound of the bucket holding the pth percentile, in seconds."""
+        if not self.count:
+            return 0.0
+
+        target = p / 100 * self.count
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= target:
+                return min((1 << index) / 1_000_000, self.max)
+
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Tracer:
+    """Collects per-stage timings into in-process histograms."""
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = defaultdict(Histogram)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the wrapped block under the given stage name."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.histograms[name].record(perf_counter() - start)
+
+    def reset(self) -> None:
+        self.histograms.clear()
+
+    def report(self) -> str:
+        """Format every stage's timings as a table, in milliseconds."""
+        lines = [
+            f"{'stage':<16}{'count':>10}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}"
+        ]
+
+        for name, hist in sorted(self.histograms.items()):
+            lines.append(
+                f"{name:<16}{hist.count:>10}"
+                + "".join(
+                    f"{value * 1000:>10.3f}"
+                    for value in (
+                        hist.mean,
+                        hist.percentile(50),
+                        hist.percentile(99),
+                        hist.max,
+                    )
+                )
+            )
+
+        return "\n".join(lines)
+
+
+class Profiler:
+    """Runs cProfile over the next N calls to a wrapped handler.
+
+    The profiler is enabled while any wrapped call is running, so time spent
+    in other tasks while a handler is suspended is included in the results.
+    """
+
+    def __init__(self):
+        self.profile: Optional[Profile] = None
+        self.remaining = 0
+        self.depth = 0
+        self.result: Optional[Future] = None
+
+    @property
+    def active(self) -> bool:
+        return self.profile is not None
+
+    def start(self, count: int) -> Future:
+        """Profile the next `count` calls, the future resolves to the stats text."""
+        if self.active:
+            raise RuntimeError("A profile is already running.")
+
+        self.profile = Profile()
+        self.remaining = count
+        # Calls still running from a cancelled profile don't count towards this one
+        self.depth = 0
+        self.result = get_event_loop().create_future()
+        return self.result
+
+    def cancel(self) -> None:
+        if self.profile and self.depth:
+            self.profile.disable()
+
+        self.profile = None
+        if self.result and not self.result.done():
+            self.result.cancel()
+
+    @contextmanager
+    def sample(self) -> Iterator[None]:
+        """Wrap a handler call, profiling it if a profile is running."""
+        profile = self.profile
+        if profile is None:
+            yield
+            return
+
+        if not self.depth:
+            profile.enable()
+        self.depth += 1
+
+        try:
+            yield
+        finally:
+            # The profile was cancelled, or replaced, while this call was running
+            if self.profile is profile:
+                self.depth -= 1
+                if not self.depth:
+                    profile.disable()
+
+                self.remaining -= 1
+                if self.remaining <= 0 and not self.depth:
+                    self.finish()
+
+    def finish(self, limit: int = 50) -> None:
+        stream = StringIO()
+        Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(limit)
+
+        self.profile = None
+        if not self.result.done():
+            self.result.set_result(stream.getvalue())
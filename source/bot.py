@@ -1,13 +1,20 @@
 from discord.ext import commands
 from discord import Intents, Message, AllowedMentions, Game
-from typing import Optional
+from typing import Dict, Optional
 from traceback import print_exc
+from asyncio import Task, create_task, gather
+from time import monotonic
 
 from aiohttp import ClientSession
 
+from helpers.tracing import Tracer, Profiler
+
+from .utils.api import APIServer
+from .utils.backends import create_database
 from .utils.database import Database
 from .utils.context import Context
 from .utils.help import Help
+from .utils.scheduler import RESTScheduler
 
 
 class Bot(commands.Bot):
@@ -28,24 +35,89 @@ class Bot(commands.Bot):
         )
 
         self.session: Optional[ClientSession] = None
-        self.db: Database = Database()
+        self.db: Database = create_database()
+        self.scheduler: RESTScheduler = RESTScheduler()
+        self.tracer: Tracer = Tracer()
+        self.profiler: Profiler = Profiler()
+        self.api: APIServer = APIServer(self)
+
+        # startup stage -> seconds taken, in the order the stages finished
+        self.startup: Dict[str, float] = {}
+        self.started = monotonic()
+        self.setup_task: Optional[Task] = None
+        self.connecting = self.started
 
     def load_cogs(self, *exts) -> None:
         """Load a set of extensions."""
 
         for ext in exts:
+            start = monotonic()
             try:
                 self.load_extension(ext)
             except Exception as e:
                 print_exc()
+            self.startup[f"load {ext}"] = monotonic() - start
+
+    async def setup_db(self) -> None:
+        """Set up the database, timing how long it takes."""
+
+        start = monotonic()
+        await self.db.setup()
+        self.startup["database"] = monotonic() - start
 
     async def login(self, *args, **kwargs) -> None:
-        """Create the ClientSession before logging in."""
+        """Create the ClientSession and start setting up the database before logging in."""
 
         self.session = ClientSession()
 
-        await self.db.setup()
+        # The database is set up alongside logging in and connecting to the gateway
+        self.setup_task = create_task(self.setup_db())
+        self.scheduler.start()
+        await self.api.start()
+
+        start = monotonic()
         await super().login(*args, **kwargs)
+        self.startup["login"] = monotonic() - start
+
+    async def connect(self, *args, **kwargs) -> None:
+        """Connect to the gateway, stopping if the database can't be set up."""
+
+        self.connecting = monotonic()
+        await gather(self.setup_task, super().connect(*args, **kwargs))
+
+    async def on_ready(self) -> None:
+        """Print how long startup took, once the database is also ready."""
+
+        if "ready" in self.startup:
+            return
+
+        self.startup["gateway"] = monotonic() - self.connecting
+        await self.db.ready.wait()
+        self.startup["ready"] = monotonic() - self.started
+
+        print(self.startup_report())
+
+    def startup_report(self) -> str:
+        """Format the time each startup stage took, in milliseconds."""
+
+        return "\n".join(
+            f"{stage:<32}{seconds * 1000:>10.1f}ms"
+            for stage, seconds in self.startup.items()
+        )
+
+    async def close(self) -> None:
+        """Flush pending database writes after disconnecting."""
+
+        if self.setup_task and not self.setup_task.done():
+            self.setup_task.cancel()
+
+        await super().close()
+        await self.api.close()
+        await self.scheduler.close()
+        await self.db.close()
+
+        if self.session:
+            await self.session.close()
 
     async def get_prefix(self, message: Message) -> str:
         """Get a dynamic prefix for the bot."""
@@ -53,12 +125,13 @@ class Bot(commands.Bot):
         if not message.guild:
             return "!"
 
-        guild_config = await self.db.fetch_guild(message.guild.id)
+        await self.db.ready.wait()
+        settings = await self.db.fetch_settings(message.guild.id)
 
-        if not guild_config:
+        if not settings:
             return "!"
 
-        return guild_config["prefix"]
+        return settings.prefix
 
     async def get_context(self, message: Message):
         return await super().get_context(message, cls=Context)
@@ -1,12 +1,14 @@
 from discord.ext import commands
 from discord import Embed, TextChannel, CategoryChannel, Role, Member, File
-from typing import Union
+from typing import List, Optional, Tuple, Union
 from io import BytesIO
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 
 from source import Bot
 from source.utils.checks import not_banned
 from source.utils.context import Context
+from source.utils.settings import GuildSettings
 from source.utils.defaults import (
     DM_RANK,
     INCREMENT,
@@ -15,12 +17,10 @@ from source.utils.defaults import (
     LEVELUP,
     ROLES,
 )
-from helpers.algorithms import Linear, Quadratic
-
-algos = {
-    "linear": Linear,
-    "quadratic": Quadratic,
-}
+from helpers.curves import MAX_COST, curves
+from helpers.cache import LRUCache
+from helpers.charts import render_breakdown
+from helpers.leaderboard import TopK
 
 
 class Commands(commands.Cog):
@@ -28,71 +28,123 @@ class Commands(commands.Cog):
 
     def __init__(self, bot: Bot):
         self.bot = bot
+        # guild_id -> ((leaderboard version, settings version), embed)
+        self.leaderboards = LRUCache(1024)
+
+        # curve key -> breakdown chart png
+        self.charts = LRUCache(256)
+        self.executor: Optional[ProcessPoolExecutor] = None
 
-    @commands.command(name="leaderboard", aliases=["lb", "top"])
+    def cog_unload(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+    @commands.group(
+        name="leaderboard", aliases=["lb", "top"], invoke_without_command=True
+    )
     @commands.guild_only()
     @commands.cooldown(rate=1, per=30, type=commands.BucketType.member)
     @not_banned()
     async def leaderboard(self, ctx: Context):
-        async with ctx.typing():
-            top = await self.bot.db.fetch_top_users(ctx.guild.id, 30)
-            guild = await ctx.guild_config()
-            algorithm = algos[guild.get("algorithm", "linear")]
-            inc = guild.get("increment", 300)
+        """Show the members with the most XP."""
+        top = await self.bot.db.fetch_leaderboard(ctx.guild.id)
+        settings = await ctx.guild_settings()
+        version = (top.version, settings.version)
+
+        # The embed only changes when the top members or the guild settings do
+        cached = self.leaderboards.get(ctx.guild.id)
+        if cached and cached[0] == version:
+            return await ctx.send(embed=cached[1])
+
+        embed = self.build_leaderboard(ctx, top, settings)
+        self.leaderboards.set(ctx.guild.id, (version, embed))
+        await ctx.send(embed=embed)
 
-            embed = Embed(title=f"Top Users in {ctx.guild}", colour=0x87CEEB)
+    # Subcommands don't run the group's checks, so they have their own
+    @leaderboard.command(name="weekly", aliases=["week"])
+    @commands.guild_only()
+    @commands.cooldown(rate=1, per=30, type=commands.BucketType.member)
+    @not_banned()
+    async def leaderboard_weekly(self, ctx: Context):
+        """Show the members who gained the most XP this week."""
+        top = await self.bot.db.fetch_period_leaderboard(ctx.guild.id, "weekly")
+        await ctx.send(embed=self.build_period_leaderboard(ctx, top, "this week"))
 
-            top = [u for u in top if ctx.guild.get_member(u["id"])]
+    @leaderboard.command(name="monthly", aliases=["month"])
+    @commands.guild_only()
+    @commands.cooldown(rate=1, per=30, type=commands.BucketType.member)
+    @not_banned()
+    async def leaderboard_monthly(self, ctx: Context):
+        """Show the members who gained the most XP this month."""
+        top = await self.bot.db.fetch_period_leaderboard(ctx.guild.id, "monthly")
+        await ctx.send(embed=self.build_period_leaderboard(ctx, top, "this month"))
+
+    def build_period_leaderboard(
+        self, ctx: Context, top: List[Tuple[int, int]], period: str
+    ) -> Embed:
+        embed = Embed(title=f"Top Users in {ctx.guild} {period}", colour=0x87CEEB)
+
+        top = [(id, xp) for id, xp in top if ctx.guild.get_member(id)][:15]
+
+        for i, (id, xp) in enumerate(top):
+            embed.add_field(
+                name=f"{i + 1} | {ctx.guild.get_member(id)}",
+                value=f"XP: {xp}",
+                inline=True,
+            )
 
-            for i, user in enumerate(top[:15]):
-                id = user["id"]
-                xp = user["xp"]
-                member = ctx.guild.get_member(id)
+        return embed
 
-                if not member:
-                    member = "User Not Found"
+    def build_leaderboard(
+        self, ctx: Context, top: TopK, settings: GuildSettings
+    ) -> Embed:
+        embed = Embed(title=f"Top Users in {ctx.guild}", colour=0x87CEEB)
 
-                level, required = algorithm.get_level(xp, inc)
+        top = [(id, xp) for id, xp in top.top() if ctx.guild.get_member(id)][:15]
+        levels, requirements = settings.curve.get_levels([xp for _, xp in top])
 
-                embed.add_field(
-                    name=f"{i + 1} | {member}",
-                    value=f"XP: {xp}\nLevel: {level}\nLevel-up: {required} xp",
-                    inline=True,
-                )
+        for i, ((id, xp), level, required) in enumerate(zip(top, levels, requirements)):
+            member = ctx.guild.get_member(id)
 
-            await ctx.send(embed=embed)
+            if not member:
+                member = "User Not Found"
+
+            embed.add_field(
+                name=f"{i + 1} | {member}",
+                value=f"XP: {xp}\nLevel: {level}\nLevel-up: {required} xp",
+                inline=True,
+            )
+
+        return embed
 
     @commands.command(name="rank", aliases=["level", "levels"])
     @commands.guild_only()
     @commands.cooldown(rate=1, per=10, type=commands.BucketType.member)
     @not_banned()
     async def rank(self, ctx: Context):
-        user = await self.bot.db.fetch_user(ctx.author.id, ctx.guild.id, False)
+        ranked = await self.bot.db.fetch_rank(ctx.author.id, ctx.guild.id)
 
         try:
             await ctx.message.delete()
         except:
             pass
 
-        if not user:
-            await ctx.author.send(
+        if ranked is None:
+            return await ctx.author.send(
                 "There isn't any rank info on you yet, try talking some more!"
             )
 
-        guild = await ctx.guild_config()
-        algorithm = algos[guild.get("algorithm", "linear")]
-        inc = guild.get("increment", 300)
-        xp = user["xp"]
-        dm_rank = guild.get("dm_rank", True)
+        settings = await ctx.guild_settings()
+        dm_rank = settings.dm_rank
 
-        level, required = algorithm.get_level(xp, inc)
+        rank, xp, ahead = ranked
+        level, required = settings.curve.get_level(xp)
 
-        rank = await self.bot.db.get_rank(ctx.author.id, ctx.guild.id)
+        description = f"Server Ranking: #{rank}\nServer Level: {level}\nServer XP: {xp} xp\nLevel-up: {required} xp"
+        if ahead is not None:
+            description += f"\nNext rank: {ahead - xp} xp"
 
-        embed = Embed(
-            description=f"Server Ranking: #{rank['rank']}\nServer Level: {level}\nServer XP: {xp} xp\nLevel-up: {required} xp",
-            colour=0x87CEEB,
-        )
+        embed = Embed(description=description, colour=0x87CEEB)
         embed.set_author(
             name=f"{ctx.author.name} | {ctx.guild}", icon_url=str(ctx.author.avatar_url)
         )
@@ -111,24 +163,26 @@ class Commands(commands.Cog):
     @not_banned()
     async def level_breakdown(self, ctx: Context):
         """Get a graphical breakdown of the current settings."""
-        config = await ctx.guild_config()
-        aname = config.get("algorithm", ALGORITHM)
-        algo = algos[aname]
-        inc = config.get("increment", INCREMENT)
-
-        level, xpt = [], []
-        for i in range(100):
-            xp = i * 1000
-            l, _ = algo.get_level(xp, inc)
-            level.append(l)
-            xpt.append(xp)
-
-        plt.plot(xpt, level)
-        plt.savefig("/tmp/lbd.png")
-        plt.cla()
+        settings = await ctx.guild_settings()
+        aname = settings.algorithm_name
+        curve = settings.curve
+
+        # The chart only depends on the curve
+        chart = self.charts.get(curve.key)
+        if chart is None:
+            if not self.executor:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=2, mp_context=get_context("spawn")
+                )
+
+            chart = await self.bot.loop.run_in_executor(
+                self.executor, render_breakdown, curve
+            )
+            self.charts.set(curve.key, chart)
+
         await ctx.send(
             content=f"Breakdown for {ctx.guild} | {aname}",
-            file=File("/tmp/lbd.png", "breakdown.png"),
+            file=File(BytesIO(chart), "breakdown.png"),
         )
 
     @commands.group(name="config", aliases=["cfg"])
@@ -169,12 +223,7 @@ class Commands(commands.Cog):
         if not value.lower() in ["true", "false"]:
             return await ctx.send("Invalid Option! Valid Options: true, false")
         opt = value.lower()
-        config = await ctx.guild_config()
-        if opt == "true":
-            config["dm_rank"] = True
-        else:
-            config["dm_rank"] = False
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.set_guild_config(ctx.guild.id, {"dm_rank": opt == "true"})
         await ctx.send(f"Successfully updated your dm rank config to: {value}")
 
     @config.command(name="reset")
@@ -219,17 +268,13 @@ class Commands(commands.Cog):
             return await ctx.send(
                 "Increments must be between 300 and 10,0000 inclusive."
             )
-        config = await ctx.guild_config()
-        config["increment"] = new
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.set_guild_config(ctx.guild.id, {"increment": new})
         await ctx.send(f"Successfully set your level increment to: {new} xp")
 
     @cfg_inc.command(name="reset")
     async def cfg_inc_reset(self, ctx: Context):
         """Reset the level increment."""
-        config = await ctx.guild_config()
-        config["increment"] = INCREMENT
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.delete_guild_config(ctx.guild.id, "increment")
         await ctx.send(f"Successfully reset your level increment to: {INCREMENT} xp")
 
     @config.group(name="modifiers", aliases=["mod", "mods", "modifier"])
@@ -286,13 +331,9 @@ class Commands(commands.Cog):
             return await ctx.send(
                 "Overrides must be a number between 0 and 5 inclusive. It can have decimals."
             )
-        config = await ctx.guild_config()
-        mods = config.get("modifiers", {})
-
-        mods[target.id] = override
-        config["modifiers"] = mods
-
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.set_guild_config_item(
+            ctx.guild.id, "modifiers", str(target.id), override
+        )
         await ctx.send(
             f"Successfully added `{target.id}` as a {type(target).__name__.lower()} override with value: {override}"
         )
@@ -308,10 +349,7 @@ class Commands(commands.Cog):
         if str(target.id) not in mods:
             return await ctx.send("There is no modifier for that target.")
 
-        del mods[str(target.id)]
-        config["modifiers"] = mods
-
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.delete_guild_config(ctx.guild.id, "modifiers", str(target.id))
         await ctx.send(
             f"Successfully removed `{target.id}` as a {type(target).__name__.lower()} override"
         )
@@ -335,17 +373,13 @@ class Commands(commands.Cog):
             return await ctx.send(
                 "Increments must be between 10s and 3,600s inclusive."
             )
-        config = await ctx.guild_config()
-        config["cooldown"] = new
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.set_guild_config(ctx.guild.id, {"cooldown": new})
         await ctx.send(f"Successfully set your cooldown to: {new}s")
 
     @cfg_cd.command(name="reset")
     async def cfg_cd_reset(self, ctx: Context):
         """Reset the cooldown."""
-        config = await ctx.guild_config()
-        config["cooldown"] = COOLDOWN
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.delete_guild_config(ctx.guild.id, "cooldown")
         await ctx.send(f"Successfully reset your cooldown to: {COOLDOWN}s")
 
     @config.group(name="algorithm", aliases=["algo"])
@@ -358,29 +392,46 @@ class Commands(commands.Cog):
     async def cfg_algo_get(self, ctx: Context):
         """Get the algorithm."""
         config = await ctx.guild_config()
-        await ctx.send(
-            f"Your current algorithm is: {config.get('algorithm', ALGORITHM)}"
-        )
+        algorithm = config.get("algorithm", ALGORITHM)
+        if algorithm == "piecewise":
+            steps = sorted((int(k), v) for k, v in config.get("steps", {}).items())
+            algorithm += " " + " ".join(f"{level}:{cost}" for level, cost in steps)
+        await ctx.send(f"Your current algorithm is: {algorithm}")
 
     @cfg_algo.command(name="set")
-    async def cfg_algo_set(self, ctx: Context, *, new: str):
-        """Set a new algorithm."""
+    async def cfg_algo_set(self, ctx: Context, new: str, *steps: str):
+        """Set a new algorithm, piecewise takes level:cost steps like `0:100 10:500`."""
         new = new.lower()
-        if not new in algos:
+        if not new in curves:
             return await ctx.send(
-                f"Valid algorithms: {', '.join([k for k in algos.keys()])}"
+                f"Valid algorithms: {', '.join([k for k in curves.keys()])}"
             )
-        config = await ctx.guild_config()
-        config["algorithm"] = new
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+
+        parsed = {}
+        for step in steps:
+            try:
+                level, cost = map(int, step.split(":"))
+            except ValueError:
+                return await ctx.send(f"Invalid step `{step}`, steps are `level:cost`")
+            if level < 0 or not 0 < cost <= MAX_COST:
+                return await ctx.send(
+                    f"Invalid step `{step}`, costs must be between 1 and {MAX_COST:,}"
+                )
+            parsed[str(level)] = cost
+
+        if new == "piecewise" and not parsed:
+            return await ctx.send("Piecewise algorithms need at least one step")
+
+        values = {"algorithm": new}
+        if new == "piecewise":
+            values["steps"] = parsed
+        await self.bot.db.set_guild_config(ctx.guild.id, values)
         await ctx.send(f"Successfully set your algorithm to: {new}")
 
     @cfg_algo.command(name="reset")
     async def cfg_algo_reset(self, ctx: Context):
         """Reset the algorithm."""
-        config = await ctx.guild_config()
-        config["algorithm"] = ALGORITHM
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.delete_guild_config(ctx.guild.id, "algorithm")
         await ctx.send(f"Successfully reset your algorithm to: {ALGORITHM}")
 
     @config.group(name="levelup", aliases=["lu"])
@@ -404,17 +455,13 @@ class Commands(commands.Cog):
         lus = ["dm", "chat", "react"]
         if not new in lus:
             return await ctx.send(f"Valid levelup actions: {', '.join(lus)}")
-        config = await ctx.guild_config()
-        config["levelup"] = {"method": new}
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.set_guild_config(ctx.guild.id, {"levelup": {"method": new}})
         await ctx.send(f"Successfully set your levelup action to: {new}")
 
     @cfg_lu.command(name="reset")
     async def cfg_lu_reset(self, ctx: Context):
         """Reset the levelup action."""
-        config = await ctx.guild_config()
-        config["levelup"] = LEVELUP
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.delete_guild_config(ctx.guild.id, "levelup")
         await ctx.send(
             f"Successfully reset your levelup action to: {LEVELUP['method']}"
         )
@@ -452,18 +499,9 @@ class Commands(commands.Cog):
         if not (1 <= level <= 10000):
             return await ctx.send("Levels must be between 1 and 10,000 inclusive.")
 
-        config = await ctx.guild_config()
-        roles = config.get("roles", ROLES)
-
-        if len(roles) >= 25:
-            return await ctx.send(
-                "For performance reasons, you can't have more than 25 level roles, please remove a level role before adding a new one."
-            )
-
-        roles[str(level)] = role.id
-        config["roles"] = roles
-
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.set_guild_config_item(
+            ctx.guild.id, "roles", str(level), role.id
+        )
         await ctx.send(
             f"Successfully added `{role.id}` as the level role for level {level}"
         )
@@ -480,19 +518,15 @@ class Commands(commands.Cog):
             if lr not in roles:
                 return await ctx.send("That is not a valid level nor role.")
             role = ctx.guild.get_role(roles[lr])
-            del roles[lr]
         else:
-            level = None
+            level, role = None, lr
             for k, v in roles.items():
                 if v == lr.id:
                     level = k
             if not level:
                 return await ctx.send("That is not a valid level nor role.")
-            del roles[level]
-
-        config["roles"] = roles
 
-        await self.bot.db.update_guild_config(ctx.guild.id, config)
+        await self.bot.db.delete_guild_config(ctx.guild.id, "roles", level)
         await ctx.send(
             f"Successfully removed `{role.id if isinstance(role, Role) else None}` as the level role for level {level}"
         )
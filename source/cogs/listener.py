@@ -1,26 +1,13 @@
 from discord.ext import commands
-from discord import Message, Object
+from discord import Message, Object, Guild, CategoryChannel
 from re import compile
-from typing import Union
-from time import time
-from collections import defaultdict
-from json import loads
+from typing import Dict, Tuple
 
 from source import Bot
-from source.utils.defaults import (
-    INCREMENT,
-    MODIFIERS,
-    COOLDOWN,
-    ALGORITHM,
-    LEVELUP,
-    ROLES,
-)
-from helpers.algorithms import Linear, Quadratic
-
-algos = {
-    "linear": Linear,
-    "quadratic": Quadratic,
-}
+from source.utils.scheduler import RESTScheduler
+from source.utils.settings import GuildSettings
+from helpers.cooldowns import CooldownStore
+from helpers.modifiers import ModifierResolver
 
 
 class Listener(commands.Cog):
@@ -29,8 +16,9 @@ class Listener(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
         self.pattern = None
-        self.cooldowns = defaultdict(int)
-        self.cache = {}
+        self.cooldowns = CooldownStore()
+        # guild_id -> (settings version, compiled modifiers)
+        self.modifiers: Dict[int, Tuple[int, ModifierResolver]] = {}
 
         self.debugging = True
 
@@ -39,80 +27,59 @@ class Listener(commands.Cog):
         if self.debugging:  # TODO: Use logging module debugs
             print(*args)
 
-    def get_modifier(self, message: Message, modifiers: dict) -> Union[float, int]:
+    def compile_modifiers(self, guild: Guild, modifiers: dict) -> ModifierResolver:
+        """Sort a guild's modifiers into user, channel, category and role tables."""
+        users, channels, categories, roles = {}, {}, {}, {}
+
+        for id, value in modifiers.items():
+            if guild.get_role(id):
+                roles[id] = value
+            elif channel := guild.get_channel(id):
+                if isinstance(channel, CategoryChannel):
+                    categories[id] = value
+                else:
+                    channels[id] = value
+            else:
+                users[id] = value
+
+        return ModifierResolver(users, channels, categories, roles)
+
+    def get_modifier(self, message: Message, settings: GuildSettings) -> float:
         """Gets the overall modifier for XP."""
-        modifiers = {int(k): v for k, v in modifiers.items()}
-        overall = 1
-
-        usermod = modifiers.get(message.author.id)
-        if usermod == 0:
-            self.debug("User", message.author.id, "has modifier overriden to 0")
-            return 0
-        elif usermod:
-            overall = usermod
-
-        channelmod = modifiers.get(message.channel.id)
-        if channelmod == 0:
-            self.debug("Channel", message.channel.id, "has modifier overriden to 0")
-            return 0
-        elif channelmod:
-            overall = channelmod
-
-        if message.channel.category:
-            catmod = modifiers.get(message.channel.id)
-            if catmod == 0:
-                self.debug(
-                    "Category", message.category.id, "has modifier overriden to 0"
-                )
-                return 0
-            elif catmod:
-                overall = catmod
-
-        role_overall = 0
-        for role in message.author.roles:
-            rolemod = modifiers.get(role.id)
-            if rolemod is None:
-                continue
-            if rolemod == 0:
-                self.debug("Role", role.id, "has modifier overriden to 0")
-                return 0
-            elif rolemod:
-                if rolemod > role_overall:
-                    role_overall = rolemod
-
-        return overall
+        if not settings.modifiers:
+            return 1
+
+        version, resolver = self.modifiers.get(message.guild.id, (None, None))
+        if version != settings.version:
+            resolver = self.compile_modifiers(message.guild, settings.modifiers)
+            self.modifiers[message.guild.id] = (settings.version, resolver)
+
+        # Member._roles is the raw id list, Member.roles would build a sorted copy
+        return resolver.resolve(
+            message.author.id,
+            message.channel.id,
+            message.channel.category_id,
+            message.author._roles,
+        )
 
     def cooldown(self, message: Message, cooldown: int) -> bool:
         """Get whether a user is on cooldown."""
-        bucket = f"{message.author.id}/{message.guild.id}"
-        now = time()
-
-        if self.cooldowns[bucket] > now:
-            return True
-
-        self.cooldowns[bucket] = now + cooldown
-        return False
+        return self.cooldowns.hit(message.author.id, message.guild.id, cooldown)
 
     async def calc_xp(self, message: Message, to_add: int):
         """Calculate a user's current and new XP."""
-        current_xp = self.cache.get(message.author.id)
-        should_create = False
+        key = (message.guild.id, message.author.id)
+        current_xp = self.bot.db.xp_cache.get(key)
         if current_xp is None:
-            user = await self.bot.db.fetch_user(message.author.id, message.guild.id)
-            if not user:
-                current_xp = 0
-                should_create = True
-            elif user["banned"]:
-                self.debug("User", message.author.id, "is banned, ignoring.")
-                return
-            else:
-                current_xp = user["xp"]
-        self.cache[message.author.id] = new = current_xp + to_add
+            # XP which is still waiting in the write buffer isn't in the db yet
+            user, pending = await self.bot.db.fetch_user_pending(
+                message.author.id, message.guild.id
+            )
+            current_xp = (user["xp"] if user else 0) + pending
+        new = current_xp + to_add
+        self.bot.db.xp_cache.set(key, new)
 
-        if should_create:
-            await self.bot.db.create_user(message.author.id, message.guild.id, new)
-        else:
-            await self.bot.db.add_xp(message.author.id, message.guild.id, to_add)
+        self.bot.db.queue_xp(message.author.id, message.guild.id, to_add, new)
 
         return current_xp, new
 
@@ -120,58 +87,34 @@ class Listener(commands.Cog):
         """Execute a levelup."""
         try:
             method = config.get("method", "dm")
-            if method == "dm":
-                await message.author.send(
-                    f"🎉 Congrats! You levelled up to level {level} in {message.guild}. You need {required} more xp to get to level {level + 1}! 🎉"
-                )
-            elif method == "chat":
-                await message.channel.send(
-                    f"🎉 Congrats {message.author.mention}! You levelled up to level {level}. You need {required} more xp to get to level {level + 1}! 🎉"
-                )
-            elif method == "react":
-                await message.add_reaction("🎉")
+            with self.bot.tracer.span("levelup.rest"):
+                if method == "dm":
+                    await message.author.send(
+                        f"🎉 Congrats! You levelled up to level {level} in {message.guild}. You need {required} more xp to get to level {level + 1}! 🎉"
+                    )
+                elif method == "chat":
+                    await message.channel.send(
+                        f"🎉 Congrats {message.author.mention}! You levelled up to level {level}. You need {required} more xp to get to level {level + 1}! 🎉"
+                    )
+                elif method == "react":
+                    await message.add_reaction("🎉")
         except Exception as e:
             print(e)
 
-    @staticmethod
-    def get_roles(config: dict, current: list, level: int) -> dict:
-        roles = [(int(k), v) for k, v in config.items()]  # [(level, role)]
-        roles.sort(reverse=True)
-
-        add = []
-        valid = []
-
-        for role in roles:
-            if role[0] <= level:
-                if role[1] not in current:
-                    add.append(role[1])
-                valid.append(role[1])
-
-        remove = []
-
-        for cr in current:
-            if cr != role[1] and cr in config.values() and cr not in valid:
-                remove.append(cr)
-
-        return {
-            "add": add,
-            "remove": remove,
-        }
-
-    async def check_roles(self, message: Message, config: dict, level: int):
+    async def check_roles(self, message: Message, settings: GuildSettings, level: int):
         """Apply the correct level roles to a user."""
-        if not config:
+        if not settings.roles:
             return
 
-        results = self.get_roles(config, [r.id for r in message.author.roles], level)
-
-        if add := results["add"]:
-            for role in add:
-                await message.author.add_roles(Object(id=role))
+        roles = settings.level_roles.reconcile(message.author._roles, level)
+        if roles is None:
+            return
 
-        if remove := results["remove"]:
-            for role in remove:
-                await message.author.remove_roles(Object(id=role))
+        try:
+            with self.bot.tracer.span("roles.rest"):
+                await message.author.edit(roles=[Object(id=role) for role in roles])
+        except Exception as e:
+            print("Roles assignment failed", e)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -179,7 +122,6 @@ class Listener(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message(self, message: Message):
-        start = time()
         if not message.guild:
             return
 
@@ -189,16 +131,27 @@ class Listener(commands.Cog):
 
         # Try to wait until we've filled the cache, might need to remove if in lots of guilds
         await self.bot.wait_until_ready()
+        await self.bot.db.ready.wait()
 
-        guild_id = message.guild.id
-        guild = await self.bot.db.fetch_guild(guild_id)
+        with self.bot.profiler.sample(), self.bot.tracer.span("total"):
+            await self.process_message(message)
+
+    async def process_message(self, message: Message):
+        """Run a guild message through the XP pipeline."""
+        span = self.bot.tracer.span
+
+        with span("settings"):
+            settings = await self.bot.db.fetch_settings(message.guild.id)
 
         # Guild isnt set up, return
-        if not guild:
+        if not settings:
+            return
+
+        if self.bot.db.is_banned(message.author.id, message.guild.id):
             return
 
         # Ignore messages starting with the prefix
-        if message.content.startswith(guild["prefix"]):
+        if message.content.startswith(settings.prefix):
             return
 
         # Respond with prefix if the bot is mentioned
@@ -206,57 +159,74 @@ class Listener(commands.Cog):
             if self.pattern.search(message.content):
                 await message.delete()
                 return await message.author.send(
-                    f"The prefix in **{message.guild}** is: `{guild['prefix']}`"
+                    f"The prefix in **{message.guild}** is: `{settings.prefix}`"
                 )
         except:
             self.debug("Received message but help isnt ready, ignoring error.")
 
-        # Get the guild config
-        config = loads(
-            guild["config"]
-        )  # TODO: Caching so that we don't load the config every time
-        default = config.get("default", 30)
-        levelinc = config.get("increment", INCREMENT)
-        modifiers = config.get("modifiers", MODIFIERS)
-        cooldown = config.get("cooldown", COOLDOWN)
-        algorithm = algos[config.get("algorithm", ALGORITHM)]
-        levelup_config = config.get("levelup", LEVELUP)
-        roles = config.get("roles", ROLES)
-
         # Get the XP modifier, highest role modifier is chosen from roles,
         # highest precendence modifier set overall is chosen,
         # precedence is user, channel, category, roles
         # If ANY modifier is explicitly 0, the overall modifier will be 0
-        modifier = self.get_modifier(message, modifiers)
+        with span("modifier"):
+            modifier = self.get_modifier(message, settings)
         self.debug("Overall modifier is", modifier)
 
         if modifier == 0:
             return  # No point doing calcs just to make it 0
 
         # Check if the user is on cooldown, if yes return
-        if self.cooldown(message, cooldown):
+        with span("cooldown"):
+            on_cooldown = self.cooldown(message, settings.cooldown)
+        if on_cooldown:
             self.debug("User", message.author.id, "is on cooldown")
             return
 
-        to_add = int(default * modifier)
+        to_add = int(settings.default * modifier)
         if not to_add:
             self.debug("Modifier wasn't 0, but mod*def still returned 0, ignoring.")
             return
 
-        current_xp, new = await self.calc_xp(message, to_add)
+        with span("xp"):
+            result = await self.calc_xp(message, to_add)
+        if not result:
+            return
 
-        level, required, levelup = algorithm.calc(current_xp, new, levelinc)
+        current_xp, new = result
 
-        try:
-            await self.check_roles(message, roles, level)
-        except Exception as e:
-            print("Roles assignment failed", e)
+        with span("algorithm"):
+            level, required, levelup = settings.curve.calc(current_xp, new)
+
+        # Discord side effects run in the background, newer ones replace older
+        # ones which haven't been sent yet for the same member
+        member = (message.guild.id, message.author.id)
 
-        self.debug("Operation completed in", time() - start)
-        if (not levelup) or not levelup_config:
+        if settings.roles:
+            with span("roles"):
+                roles = settings.level_roles.reconcile(message.author._roles, level)
+                if roles is not None:
+                    self.bot.scheduler.submit(
+                        ("roles", member),
+                        ("member", member),
+                        RESTScheduler.ROLES,
+                        lambda: self.check_roles(message, settings, level),
+                    )
+
+        if (not levelup) or not settings.levelup:
             return
 
-        await self.level_up(message, levelup_config, level, required)
+        with span("levelup"):
+            if settings.levelup.get("method", "dm") == "dm":
+                route = ("dm", message.author.id)
+            else:
+                route = ("channel", message.channel.id)
+
+            self.bot.scheduler.submit(
+                ("levelup", member),
+                route,
+                RESTScheduler.LEVELUP,
+                lambda: self.level_up(message, settings.levelup, level, required),
+            )
 
 
 def setup(bot: Bot):
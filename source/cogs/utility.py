@@ -1,8 +1,13 @@
 from discord.ext import commands
-from discord import Embed
+from discord import Embed, File
 from typing import Optional, Union, Tuple
 from types import ModuleType
-from asyncio import sleep
+from asyncio import Queue, create_task, wait_for, TimeoutError
+from time import monotonic
+from io import BytesIO
+from gzip import GzipFile
+from csv import Error as CSVError
+from json import loads
 from pathlib import Path
 from inspect import getsourcefile, getsourcelines
 
@@ -10,6 +15,10 @@ from source import Bot
 from source.utils.checks import not_banned, in_guild_or_dm
 from source.utils.context import Context
 from source.utils.converters import SourceConverter
+from source.utils.exports import InvalidImport, read_users
+from source.utils.mee6 import fetch_pages, batches
+
+IMPORT_BATCH = 10_000
 
 
 class Utility(commands.Cog):
@@ -36,6 +45,57 @@ class Utility(commands.Cog):
 
         await ctx.send(f"Your prefix for this server has been {wording} to: `{prefix}`")
 
+    @commands.command(name="export")
+    @commands.check_any(
+        commands.has_guild_permissions(manage_guild=True), commands.is_owner()
+    )
+    @commands.guild_only()
+    @commands.cooldown(rate=1, per=300, type=commands.BucketType.guild)
+    @not_banned()
+    async def export(self, ctx: Context):
+        """Export this server's XP data as a compressed CSV file."""
+        buffer = BytesIO()
+
+        with GzipFile(fileobj=buffer, mode="wb") as compressed:
+
+            async def write(chunk: bytes):
+                compressed.write(chunk)
+
+            await self.bot.db.export_users(ctx.guild.id, write)
+
+        buffer.seek(0)
+        await ctx.send(
+            content=f"XP export for {ctx.guild}",
+            file=File(buffer, f"maelstrom-{ctx.guild.id}.csv.gz"),
+        )
+
+    @commands.command(name="import")
+    @commands.check_any(
+        commands.has_guild_permissions(manage_guild=True), commands.is_owner()
+    )
+    @commands.guild_only()
+    @commands.cooldown(rate=1, per=300, type=commands.BucketType.guild)
+    @not_banned()
+    async def import_(self, ctx: Context):
+        """Import XP data from an attached CSV file, as made by export."""
+        if not ctx.message.attachments:
+            return await ctx.send(
+                "Attach a CSV file with `id` and `xp` columns, optionally gzip compressed."
+            )
+
+        data = await ctx.message.attachments[0].read()
+
+        async def users():
+            for batch in read_users(data, IMPORT_BATCH):
+                yield batch
+
+        try:
+            count = await self.bot.db.import_users(ctx.guild.id, users())
+        except (InvalidImport, OSError, EOFError, UnicodeDecodeError, CSVError) as e:
+            return await ctx.send(f"Import failed, no data has been changed: {e}")
+
+        await ctx.send(f"Successfully imported {count} users.")
+
     @commands.command(name="invite")
     @commands.cooldown(rate=1, per=3, type=commands.BucketType.member)
     async def invite(self, ctx: Context):
@@ -66,43 +126,152 @@ class Utility(commands.Cog):
         if resp.content.lower() not in ["yes", "y"]:
             return
 
-        await ctx.send("Starting import...")
-        await self.bot.db.clear_guild(guild)
+        status = await ctx.send("Starting import...")
+
+        # A small queue keeps memory bounded if MEE6 is faster than the db
+        queue = Queue(maxsize=8)
+        producer = create_task(fetch_pages(self.bot.session, guild, queue))
+
+        async def users():
+            count = 0
+            edited = monotonic()
+
+            async for batch in batches(queue, IMPORT_BATCH):
+                yield batch
+                count += len(batch)
+
+                if monotonic() - edited > 5:
+                    edited = monotonic()
+                    await status.edit(content=f"Importing... {count} users so far")
 
-        pages = 0
-        user_count = 0
-        userdata = {}
+            # Raise any fetch error before the swap so the transaction rolls back
+            await producer
 
-        while True:
-            page = await self.bot.session.get(
-                f"https://mee6.xyz/api/plugins/levels/leaderboard/{guild}?page={pages}"
+        try:
+            count = await self.bot.db.import_users(guild, users(), replace=True)
+        except Exception as e:
+            producer.cancel()
+            return await status.edit(
+                content=f"Import failed, the guild's data hasn't been changed: {e}"
             )
-            if page.status >= 400:  # TODO: figure out how to deal with the ratelimits
-                print(page.status, page.headers)
-                break
 
-            pages += 1
+        await status.edit(content=f"Finished! Imported {count} users from MEE6.")
 
-            data = await page.json()
-            users = data["players"]
+    @commands.group(name="ban")
+    @commands.is_owner()
+    async def ban(self, ctx: Context):
+        """Ban a user or guild from using Maelstrom."""
+        if not ctx.invoked_subcommand:
+            await ctx.send_help("ban")
+
+    @ban.command(name="user")
+    async def ban_user(self, ctx: Context, user: int):
+        """Ban a user from using Maelstrom in every guild."""
+        await self.bot.db.ban_user(user)
+        await ctx.send(f"Successfully banned user `{user}`")
+
+    @ban.command(name="guild")
+    async def ban_guild(self, ctx: Context, guild: int):
+        """Ban a guild from using Maelstrom."""
+        await self.bot.db.set_guild_banned(guild, True)
+        await ctx.send(f"Successfully banned guild `{guild}`")
+
+    @commands.group(name="unban")
+    @commands.is_owner()
+    async def unban(self, ctx: Context):
+        """Unban a user or guild."""
+        if not ctx.invoked_subcommand:
+            await ctx.send_help("unban")
+
+    @unban.command(name="user")
+    async def unban_user(self, ctx: Context, user: int):
+        """Unban a user in every guild."""
+        await self.bot.db.unban_user(user)
+        await ctx.send(f"Successfully unbanned user `{user}`")
+
+    @unban.command(name="guild")
+    async def unban_guild(self, ctx: Context, guild: int):
+        """Unban a guild."""
+        await self.bot.db.set_guild_banned(guild, False)
+        await ctx.send(f"Successfully unbanned guild `{guild}`")
+
+    @commands.command(name="usage")
+    @commands.is_owner()
+    async def usage(self, ctx: Context, key: str, *, value: str):
+        """Find the guilds whose config has a key set to a value, like `algorithm quadratic`."""
+        try:
+            value = loads(value)
+        except ValueError:
+            pass
 
-            if len(users) == 0:
-                break
+        guilds = await self.bot.db.fetch_guilds_with_config({key: value})
+        listed = ", ".join(f"`{guild}`" for guild in guilds[:20])
+        await ctx.send(f"{len(guilds)} guilds have {key} set to {value!r}: {listed}")
 
-            for user in users:
-                user_count += 1
-                userdata[user["id"]] = (int(user["id"]), guild, user["xp"], 0, False)
+    @commands.group(name="apikey")
+    @commands.is_owner()
+    async def apikey(self, ctx: Context):
+        """Manage the keys for the HTTP API."""
+        if not ctx.invoked_subcommand:
+            await ctx.send_help("apikey")
+
+    @apikey.command(name="create")
+    async def apikey_create(self, ctx: Context, guild: int):
+        """Create an API key for a guild, it's sent in DMs."""
+        token = await self.bot.db.create_api_key(guild)
+        await ctx.author.send(f"API key for guild `{guild}`: `{token}`")
+        await ctx.send(f"Created an API key for guild `{guild}`, check your DMs.")
+
+    @apikey.command(name="revoke")
+    async def apikey_revoke(self, ctx: Context, token: str):
+        """Revoke an API key."""
+        if not await self.bot.db.delete_api_key(token):
+            return await ctx.send("That API key doesn't exist.")
+
+        self.bot.api.keys.pop(token, None)
+        await ctx.send("Successfully revoked the API key.")
+
+    @commands.command(name="timings")
+    @commands.is_owner()
+    async def timings(self, ctx: Context, reset: bool = False):
+        """Show the per-stage latency of the XP pipeline."""
+        listener = self.bot.get_cog("Listener")
+        cache = self.bot.db.xp_cache
 
-            print(f"Page {pages} | Sleeping")
-            await sleep(1)
+        report = self.bot.tracer.report()
+        report += f"\n\nxp cache: {len(cache)} entries, {cache.hits} hits, {cache.misses} misses, {cache.evictions} evictions"
+        if listener:
+            cooldowns = listener.cooldowns
+            report += f"\ncooldowns: {len(cooldowns)} entries, {cooldowns.evictions} evictions"
+        report += f"\nrest queue: {len(self.bot.scheduler)} jobs, {self.bot.scheduler.coalesced} coalesced, {self.bot.scheduler.dropped} dropped"
+        report += f"\n\nstartup:\n{self.bot.startup_report()}"
 
-        await ctx.send(
-            f"Successfully downloaded {pages + 1} pages ({user_count + 1} users) from MEE6 levelling, transferring to db..."
-        )
+        if reset:
+            self.bot.tracer.reset()
 
-        await self.bot.db.add_users([v for v in userdata.values()])
+        await ctx.send(f"```\n{report}\n```")
+
+    @commands.command(name="profile")
+    @commands.is_owner()
+    async def profile(self, ctx: Context, messages: int = 1000, timeout: int = 600):
+        """Profile the XP pipeline over the next N messages."""
+        try:
+            result = self.bot.profiler.start(messages)
+        except RuntimeError as e:
+            return await ctx.send(str(e))
 
-        await ctx.send("Finished!")
+        await ctx.send(f"Profiling the next {messages} messages...")
+
+        try:
+            stats = await wait_for(result, timeout)
+        except TimeoutError:
+            self.bot.profiler.cancel()
+            return await ctx.send("Timed out before enough messages were received.")
+
+        await ctx.send(
+            content=f"Profile of {messages} messages",
+            file=File(BytesIO(stats.encode()), "profile.txt"),
+        )
 
     @commands.command(aliases=("src", "github", "git"), invoke_without_command=True)
     @commands.cooldown(rate=1, per=5, type=commands.BucketType.member)
@@ -0,0 +1,197 @@
+from hashlib import blake2b
+from json import dumps
+from os import getenv
+from time import monotonic
+from typing import Optional, Tuple
+
+from aiohttp import web
+
+from helpers.cache import LRUCache
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# Looked up keys are remembered for this long, so revoking one takes at most this long
+KEY_TTL = 60
+
+
+def error(cls, message: str) -> web.HTTPException:
+    """Create an HTTP error with a JSON body."""
+    return cls(text=dumps({"error": message}), content_type="application/json")
+
+
+class APIServer:
+    """An HTTP API serving guild leaderboards, ranks and config.
+
+    Every request needs an API key for the guild in its Authorization header.
+    Responses are cached for API_CACHE_TTL seconds and carry an ETag, so
+    clients polling with If-None-Match get an empty 304 when nothing changed.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.host = getenv("API_HOST", "127.0.0.1")
+        # Unset in every process but one, each process would otherwise need its own port
+        self.port = getenv("API_PORT")
+        self.ttl = float(getenv("API_CACHE_TTL", 5))
+
+        # path with query -> (expires, etag, body)
+        self.responses = LRUCache(4096)
+        # token -> (expires, guild id or None if the token isn't valid)
+        self.keys = LRUCache(1024)
+
+        self.app = web.Application(middlewares=[self.authenticate])
+        self.app.add_routes(
+            [
+                web.get(r"/guilds/{guild_id:\d+}/leaderboard", self.leaderboard),
+                web.get(r"/guilds/{guild_id:\d+}/rank/{user_id:\d+}", self.rank),
+                web.get(r"/guilds/{guild_id:\d+}/config", self.config),
+            ]
+        )
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        """Start serving, if this process has been given API_PORT."""
+        if not self.port:
+            return
+
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, int(self.port)).start()
+
+    async def close(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def fetch_key_guild(self, token: str) -> Optional[int]:
+        """Get the guild an API key belongs to, or None if it isn't valid."""
+        cached = self.keys.get(token)
+        if cached and cached[0] > monotonic():
+            return cached[1]
+
+        key = await self.bot.db.fetch_api_key(token)
+        guild_id = key["guildid"] if key else None
+        self.keys.set(token, (monotonic() + KEY_TTL, guild_id))
+
+        return guild_id
+
+    @web.middleware
+    async def authenticate(self, request: web.Request, handler):
+        """Check the API key, then serve from the response cache where possible."""
+        token = request.headers.get("Authorization", "")
+        if token.startswith("Bearer "):
+            token = token[7:]
+
+        if not token:
+            raise error(web.HTTPUnauthorized, "An API key is required.")
+
+        await self.bot.db.ready.wait()
+        guild_id = await self.fetch_key_guild(token)
+
+        if guild_id is None:
+            raise error(web.HTTPUnauthorized, "The API key isn't valid.")
+        if str(guild_id) != request.match_info.get("guild_id"):
+            raise error(web.HTTPForbidden, "The API key is for a different guild.")
+
+        key = request.path_qs
+        cached = self.responses.get(key)
+
+        if cached and cached[0] > monotonic():
+            _, etag, body = cached
+        else:
+            body = dumps(await handler(request)).encode()
+            etag = f'"{blake2b(body, digest_size=16).hexdigest()}"'
+            self.responses.set(key, (monotonic() + self.ttl, etag, body))
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"max-age={int(self.ttl)}",
+        }
+
+        if etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    @staticmethod
+    def parse_int(request: web.Request, name: str) -> Optional[int]:
+        value = request.query.get(name)
+        if value is None:
+            return None
+
+        try:
+            return int(value)
+        except ValueError:
+            raise error(web.HTTPBadRequest, f"`{name}` must be an integer.")
+
+    async def leaderboard(self, request: web.Request) -> dict:
+        """A page of the leaderboard, continued from the `after_xp` and `after_id` of the last page."""
+        guild_id = int(request.match_info["guild_id"])
+
+        limit = self.parse_int(request, "limit") or PAGE_SIZE
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+        after_xp = self.parse_int(request, "after_xp")
+        after_id = self.parse_int(request, "after_id")
+        after: Optional[Tuple[int, int]] = None
+
+        if (after_xp is None) != (after_id is None):
+            raise error(
+                web.HTTPBadRequest, "`after_xp` and `after_id` must be given together."
+            )
+        if after_xp is not None:
+            after = (after_xp, after_id)
+
+        users = await self.bot.db.fetch_users_page(guild_id, limit, after)
+        settings = await self.bot.db.fetch_settings(guild_id)
+
+        if settings and users:
+            levels, _ = settings.curve.get_levels([xp for _, xp in users])
+        else:
+            levels = [0] * len(users)
+
+        page = [
+            {"id": str(id), "xp": xp, "level": int(level)}
+            for (id, xp), level in zip(users, levels)
+        ]
+
+        # Ids are strings, snowflakes don't fit in a JavaScript number
+        next_page = None
+        if len(users) == limit:
+            id, xp = users[-1]
+            next_page = {"after_xp": xp, "after_id": str(id)}
+
+        return {"users": page, "next": next_page}
+
+    async def rank(self, request: web.Request) -> dict:
+        guild_id = int(request.match_info["guild_id"])
+        user_id = int(request.match_info["user_id"])
+
+        # Only the process with the guild keeps its rank index up to date
+        owned = self.bot.get_guild(guild_id) is not None
+        ranked = await self.bot.db.fetch_rank(user_id, guild_id, indexed=owned)
+
+        if ranked is None:
+            raise error(web.HTTPNotFound, "There isn't any rank info on that user.")
+
+        rank, xp, _ = ranked
+
+        settings = await self.bot.db.fetch_settings(guild_id)
+        level, required = settings.curve.get_level(xp) if settings else (0, 0)
+
+        return {
+            "id": str(user_id),
+            "rank": rank,
+            "xp": xp,
+            "level": level,
+            "required": required,
+        }
+
+    async def config(self, request: web.Request) -> dict:
+        guild_id = int(request.match_info["guild_id"])
+        settings = await self.bot.db.fetch_settings(guild_id)
+
+        if not settings:
+            raise error(web.HTTPNotFound, "The guild isn't set up.")
+
+        return {"prefix": settings.prefix, "config": dict(settings.config)}
@@ -0,0 +1,15 @@
+from os import getenv
+from typing import Dict, Type
+
+from .database import Database
+from .memory import MemoryDatabase
+
+backends: Dict[str, Type[Database]] = {
+    "postgres": Database,
+    "memory": MemoryDatabase,
+}
+
+
+def create_database() -> Database:
+    """Create the database backend selected by DB_BACKEND."""
+    return backends[getenv("DB_BACKEND", "postgres")]()
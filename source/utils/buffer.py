@@ -0,0 +1,118 @@
+from asyncio import Lock, Task, create_task, sleep
+from os import getenv
+from traceback import print_exc
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class XPBuffer:
+    """A write-behind buffer which batches XP gains into periodic bulk upserts."""
+
+    def __init__(self, db):
+        self.db = db
+        self.interval = float(getenv("XP_FLUSH_INTERVAL", 10))
+        self.size = int(getenv("XP_FLUSH_SIZE", 5000))
+
+        # (guild_id, user_id) -> xp gained since the last flush
+        self.pending: Dict[Tuple[int, int], int] = {}
+        # The batch being written, still counted until its transaction commits
+        self.flushing: Dict[Tuple[int, int], int] = {}
+        self.lock = Lock()
+        # Incremented whenever a batch starts being written
+        self.flushes = 0
+        self.task: Optional[Task] = None
+        self.early: Optional[Task] = None
+
+    def start(self) -> None:
+        """Start the background flush loop."""
+        if self.task is None:
+            self.task = create_task(self.run())
+
+    async def run(self) -> None:
+        while True:
+            await sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                print_exc()
+
+    async def flush_early(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            print_exc()
+
+    def add(self, id: int, guild_id: int, xp: int) -> None:
+        """Add XP for a user, flushing early if the buffer is full."""
+        key = (guild_id, id)
+        self.pending[key] = self.pending.get(key, 0) + xp
+
+        if len(self.pending) >= self.size and not self.lock.locked():
+            if self.early is None or self.early.done():
+                self.early = create_task(self.flush_early())
+
+    def get(self, id: int, guild_id: int) -> int:
+        """Get the XP a user has gained which hasn't been written yet."""
+        key = (guild_id, id)
+        return self.pending.get(key, 0) + self.flushing.get(key, 0)
+
+    def get_guild(self, guild_id: int) -> Dict[int, int]:
+        """Get the XP gained in a guild which hasn't been written yet, by member."""
+        gains: Dict[int, int] = {}
+        for batch in (self.flushing, self.pending):
+            for (guild, id), xp in batch.items():
+                if guild == guild_id:
+                    gains[id] = gains.get(id, 0) + xp
+
+        return gains
+
+    async def consistent(self, read: Callable[[], Awaitable[T]]) -> T:
+        """Run a database read which no flush overlapped, so pending XP can be added to it.
+
+        A read racing a commit could see the batch both in the database and
+        in `flushing`, so it's retried once the flush is done.
+        """
+        while True:
+            if self.lock.locked():
+                async with self.lock:
+                    pass
+
+            flushes = self.flushes
+            result = await read()
+
+            if flushes == self.flushes and not self.lock.locked():
+                return result
+
+    def discard_guild(self, guild_id: int) -> None:
+        """Drop the pending XP for a guild which is being cleared."""
+        for key in [key for key in self.pending if key[0] == guild_id]:
+            del self.pending[key]
+
+    async def flush(self) -> None:
+        """Write all pending XP to the database in a single batch."""
+        async with self.lock:
+            if not self.pending:
+                return
+
+            batch, self.pending = self.pending, {}
+            self.flushing = batch
+            self.flushes += 1
+
+            try:
+                await self.db.flush_xp(batch)
+            except Exception:
+                # Put the batch back so the next flush can retry it
+                for key, xp in batch.items():
+                    self.pending[key] = self.pending.get(key, 0) + xp
+                raise
+            finally:
+                self.flushing = {}
+
+    async def close(self) -> None:
+        """Stop the flush loop and write anything still pending."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+        await self.flush()
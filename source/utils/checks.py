@@ -3,16 +3,9 @@ from discord.ext.commands import check, Context
 
 def not_banned():
     async def predicate(ctx: Context):
-        user = await ctx.bot.db.user_is_banned(ctx.author.id)
-        if user and user["banned"]:
-            return False
-
-        if ctx.guild:
-            guild = await ctx.bot.db.fetch_guild(ctx.guild.id)
-            if guild and guild["banned"]:
-                return False
-
-        return True
+        return not ctx.bot.db.is_banned(
+            ctx.author.id, ctx.guild.id if ctx.guild else None
+        )
 
     return check(predicate)
 
@@ -1,15 +1,22 @@
 from discord.ext.commands import Context as _BaseContext
+from copy import deepcopy
 
-import json
+from .settings import GuildSettings
 
 
 class Context(_BaseContext):
     """A Custom Context for extra functionality."""
 
+    async def guild_settings(self) -> GuildSettings:
+        """Gets the parsed settings for the guild, falling back to the defaults."""
+        settings = await self.bot.db.fetch_settings(self.guild.id)
+
+        return settings or GuildSettings.empty(self.guild.id)
+
     async def guild_config(self):
-        """Gets the config for the guild."""
-        guild = await self.bot.db.fetch_guild(self.guild.id)
+        """Gets a copy of the config for the guild which is safe to modify."""
+        settings = await self.bot.db.fetch_settings(self.guild.id)
 
-        if guild:
-            return json.loads(guild["config"])
+        if settings:
+            return deepcopy(dict(settings.config))
         return {}
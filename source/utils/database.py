@@ -1,23 +1,129 @@
-from asyncpg import create_pool
+from asyncpg import Connection, connect, create_pool
+from asyncio import Event, Task, create_task, get_running_loop, sleep
+from datetime import date, datetime, timezone
 from os import getenv
-from json import dumps
+from secrets import token_hex
+from traceback import print_exc
+from json import dumps, loads
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from helpers.cache import LRUCache
+from helpers.leaderboard import TopK
+from helpers.periods import next_period, period_start, retention_cutoff
+from helpers.ranking import RankIndex
+
+from .buffer import XPBuffer
+from .indexes import GuildIndexes
+from .migrations import migrate
+from .settings import GuildSettings
+
+LEADERBOARD_SIZE = 30
+
+# Windowed XP tables, each partitioned by the first day of its period
+PERIOD_TABLES = {"weekly": "WeeklyXP", "monthly": "MonthlyXP"}
+
+# Held while creating and dropping period partitions
+PERIOD_LOCK = 0x4D41454D
 
 
 class Database:
     """A database interface for the bot to connect to Postgres."""
 
     def __init__(self):
-        self.banned = set()
+        # ids of users who are banned in any guild
+        self.banned: Set[int] = set()
+        self.pool = None
+        self.listener: Optional[Connection] = None
+        self.buffer = XPBuffer(self)
+        # Set once setup has finished and the database can be used
+        self.ready = Event()
 
-    async def setup(self):
-        self.pool = await create_pool(
+        # Number of past periods to keep windowed XP for
+        self.retention = int(getenv("PERIOD_RETENTION", 1))
+        # kind -> first day of the current period, which has a partition
+        self.periods: Dict[str, date] = {}
+        self.maintenance: Optional[Task] = None
+
+        # (guild_id, user_id) -> current xp, including gains still in the buffer
+        self.xp_cache = LRUCache(int(getenv("XP_CACHE_SIZE", 100_000)))
+
+        # guild_id -> rank index, for guilds which have used rank recently
+        self.ranks = GuildIndexes(
+            self,
+            self.load_rank_index,
+            float(getenv("RANK_IDLE_TIMEOUT", 900)),
+            int(getenv("RANK_MAX_GUILDS", 1000)),
+            int(getenv("RANK_MAX_ENTRIES", 2_000_000)),
+        )
+        # Guilds with more members than this are ranked with SQL instead
+        self.rank_index_limit = int(getenv("RANK_INDEX_MAX_MEMBERS", 100_000))
+
+        # guild_id -> top members, for guilds which have used leaderboard recently
+        self.leaderboards = GuildIndexes(
+            self,
+            self.load_leaderboard,
+            float(getenv("RANK_IDLE_TIMEOUT", 900)),
+            int(getenv("RANK_MAX_GUILDS", 1000)),
+        )
+
+        # guild_id -> parsed settings, a mirror of the whole Guilds table
+        self.settings: Dict[int, GuildSettings] = {}
+        self._reloads: Dict[int, int] = {}
+
+    @staticmethod
+    def options() -> dict:
+        return dict(
             host=getenv("DB_HOST", "127.0.0.1"),
             port=getenv("DB_PORT", 5432),
             database=getenv("DB_DATABASE", "maelstrom"),
             user=getenv("DB_USER", "root"),
             password=getenv("DB_PASS", "password"),
+            # Queries are prepared once per connection and reused from this cache
+            statement_cache_size=int(getenv("DB_STATEMENT_CACHE_SIZE", 100)),
         )
 
+    async def setup(self):
+        self.pool = await create_pool(
+            **self.options(),
+            min_size=int(getenv("DB_POOL_MIN", 10)),
+            max_size=int(getenv("DB_POOL_MAX", 10)),
+            init=self.init_connection,
+        )
+
+        async with self.pool.acquire() as conn:
+            for migration in await migrate(conn):
+                print("Applied migration", migration)
+
+        await self.listen()
+        await self.load_guilds()
+        await self.load_bans()
+        await self.maintain_periods()
+
+        self.buffer.start()
+        self.maintenance = create_task(self.run_maintenance())
+        self.ready.set()
+
+    @staticmethod
+    async def init_connection(conn: Connection):
+        # Guild configs are JSONB, this lets them be passed as plain dicts
+        await conn.set_type_codec(
+            "jsonb", encoder=dumps, decoder=loads, schema="pg_catalog"
+        )
+
+    async def close(self):
+        if not self.pool:
+            return
+
+        if self.listener:
+            listener, self.listener = self.listener, None
+            await listener.close()
+
+        if self.maintenance:
+            self.maintenance.cancel()
+
+        await self.buffer.close()
+        await self.pool.close()
+
     async def execute(self, query: str, *args):
         async with self.pool.acquire() as conn:
             await conn.execute(query, *args)
@@ -30,44 +136,228 @@ class Database:
         async with self.pool.acquire() as conn:
             return await conn.fetch(query, *args)
 
+    async def listen(self):
+        """Listen for guild changes made by other bot processes."""
+        self.listener = await connect(**self.options())
+        self.listener.add_termination_listener(self.on_listener_closed)
+        await self.listener.add_listener("guilds", self.on_guild_notify)
+        await self.listener.add_listener("bans", self.on_ban_notify)
+
+    def on_guild_notify(self, conn, pid: int, channel: str, payload: str):
+        create_task(self.reload_guild(int(payload)))
+
+    def on_ban_notify(self, conn, pid: int, channel: str, payload: str):
+        create_task(self.reload_ban(int(payload)))
+
+    def on_listener_closed(self, conn):
+        # The listener is cleared first when we close it ourselves
+        if conn is self.listener:
+            create_task(self.relisten())
+
+    async def relisten(self):
+        while True:
+            try:
+                await self.listen()
+                break
+            except Exception:
+                print_exc()
+                await sleep(5)
+
+        # Anything published while we were disconnected was missed
+        await self.load_guilds()
+        await self.load_bans()
+
+    async def load_guilds(self):
+        """Load every guild's settings into memory."""
+        guilds = await self.fetch("SELECT * FROM Guilds;")
+
+        self.settings = {
+            guild["id"]: GuildSettings.from_record(guild) for guild in guilds
+        }
+
+    async def reload_guild(self, id: int):
+        """Reload a single guild's settings from the database."""
+        reload = self._reloads[id] = self._reloads.get(id, 0) + 1
+        guild = await self.fetch_guild(id)
+
+        # A newer reload started while this one was fetching, let that one win
+        if self._reloads.get(id) != reload:
+            return
+        del self._reloads[id]
+
+        if guild:
+            self.settings[id] = GuildSettings.from_record(guild)
+        else:
+            self.settings.pop(id, None)
+
+    async def publish_guild(self, id: int):
+        """Reload a guild after a write and tell the other processes to as well."""
+        await self.execute("SELECT pg_notify('guilds', $1);", str(id))
+        await self.reload_guild(id)
+
     async def create_guild(self, id: int, prefix: str = "!", config: dict = {}):
         await self.execute(
             "INSERT INTO Guilds (id, prefix, config) VALUES ($1, $2, $3);",
             id,
             prefix,
-            dumps(config),
+            config,
         )
+        await self.publish_guild(id)
 
     async def update_guild_prefix(self, id: int, prefix: str):
-        if not await self.fetch_guild(id):
-            return await self.create_guild(id, prefix)
-
-        await self.execute("UPDATE Guilds SET prefix = $1 WHERE id = $2;", prefix, id)
+        await self.execute(
+            "INSERT INTO Guilds (id, prefix) VALUES ($1, $2) "
+            "ON CONFLICT (id) DO UPDATE SET prefix = EXCLUDED.prefix;",
+            id,
+            prefix,
+        )
+        await self.publish_guild(id)
 
     async def update_guild_config(self, id: int, config: dict):
-        if not await self.fetch_guild(id):
-            await self.create_guild(id)
-
+        """Replace a guild's whole config."""
         await self.execute(
-            "UPDATE Guilds SET config = $1 WHERE id = $2;", dumps(config), id
+            "INSERT INTO Guilds (id, config) VALUES ($1, $2) "
+            "ON CONFLICT (id) DO UPDATE SET config = EXCLUDED.config;",
+            id,
+            config,
         )
+        await self.publish_guild(id)
 
-    async def fetch_guild(self, id: int):
-
-        return await self.fetchrow("SELECT * FROM Guilds WHERE id = $1;", id)
+    async def set_guild_config(self, id: int, values: dict):
+        """Set top level config keys, leaving every other key as it is."""
+        await self.execute(
+            "INSERT INTO Guilds (id, config) VALUES ($1, $2) "
+            "ON CONFLICT (id) DO UPDATE SET config = Guilds.config || EXCLUDED.config;",
+            id,
+            values,
+        )
+        await self.publish_guild(id)
 
-    async def create_user(self, id: int, guild_id: int, xp: int = 0):
+    async def set_guild_config_item(self, id: int, key: str, item: str, value):
+        """Set a single item of a config key which is a mapping, like modifiers."""
         await self.execute(
-            "INSERT INTO Users (id, guildid, xp) VALUES ($1, $2, $3);", id, guild_id, xp
+            "INSERT INTO Guilds (id, config) VALUES ($1, jsonb_build_object($2::text, jsonb_build_object($3::text, $4::jsonb))) "
+            "ON CONFLICT (id) DO UPDATE SET config = Guilds.config || jsonb_build_object("
+            "$2::text, COALESCE(Guilds.config -> $2::text, '{}') || jsonb_build_object($3::text, $4::jsonb));",
+            id,
+            key,
+            item,
+            value,
         )
+        await self.publish_guild(id)
 
-    async def add_xp(self, id: int, guild_id: int, xp: int = 0):
+    async def delete_guild_config(self, id: int, *path: str):
+        """Remove a config key, or an item of one, so that it falls back to the default."""
         await self.execute(
-            "UPDATE Users SET xp = xp + $3 WHERE id = $1 AND guildid = $2;",
+            "UPDATE Guilds SET config = config #- $2::text[] WHERE id = $1;",
             id,
-            guild_id,
-            xp,
+            list(path),
         )
+        await self.publish_guild(id)
+
+    async def fetch_guilds_with_config(self, config: dict) -> List[int]:
+        """Get the ids of every guild whose config contains the given values."""
+        guilds = await self.fetch("SELECT id FROM Guilds WHERE config @> $1;", config)
+
+        return [guild["id"] for guild in guilds]
+
+    async def fetch_guild(self, id: int):
+
+        return await self.fetchrow("SELECT * FROM Guilds WHERE id = $1;", id)
+
+    async def fetch_settings(self, id: int) -> Optional[GuildSettings]:
+        """Get the parsed settings for a guild, or None if it isn't set up."""
+        return self.settings.get(id)
+
+    def queue_xp(self, id: int, guild_id: int, xp: int, total: int):
+        """Queue an XP gain to be written in the next batch."""
+        self.buffer.add(id, guild_id, xp)
+        self.ranks.set(guild_id, id, total)
+        self.leaderboards.set(guild_id, id, total)
+
+    def pending_xp(self, id: int, guild_id: int) -> int:
+        return self.buffer.get(id, guild_id)
+
+    async def fetch_user_pending(self, id: int, guild_id: int):
+        """Get a user's row and the XP they've gained which isn't in it yet."""
+        user = await self.buffer.consistent(lambda: self.fetch_user(id, guild_id))
+        return user, self.pending_xp(id, guild_id)
+
+    @staticmethod
+    def current_periods() -> Dict[str, date]:
+        today = datetime.now(timezone.utc).date()
+        return {kind: period_start(kind, today) for kind in PERIOD_TABLES}
+
+    async def run_maintenance(self):
+        while True:
+            await sleep(3600)
+            try:
+                await self.maintain_periods()
+            except Exception:
+                print_exc()
+
+    async def maintain_periods(self):
+        """Create partitions for the current and next periods, and drop expired ones.
+
+        Old windowed XP is retired by dropping its whole partition, so nothing
+        ever has to rewrite rows to reset it.
+        """
+        periods = self.current_periods()
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1);", PERIOD_LOCK)
+
+                for kind, table in PERIOD_TABLES.items():
+                    start = periods[kind]
+                    for begin in (start, next_period(kind, start)):
+                        await conn.execute(
+                            f"CREATE TABLE IF NOT EXISTS {table}_p{begin:%Y%m%d} PARTITION OF {table} "
+                            f"FOR VALUES FROM ('{begin}') TO ('{next_period(kind, begin)}');"
+                        )
+
+                    cutoff = retention_cutoff(kind, start, self.retention)
+                    partitions = await conn.fetch(
+                        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                        "WHERE i.inhparent = $1::regclass;",
+                        table.lower(),
+                    )
+                    for partition in partitions:
+                        name = partition["relname"]
+                        begin = datetime.strptime(name.rsplit("_p", 1)[1], "%Y%m%d")
+                        if begin.date() < cutoff:
+                            await conn.execute(f"DROP TABLE IF EXISTS {name};")
+
+        self.periods = periods
+
+    async def flush_xp(self, batch: dict):
+        """Upsert a batch of {(guild_id, id): xp} gains in one round trip."""
+        periods = self.current_periods()
+        if periods != self.periods:
+            await self.maintain_periods()
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "CREATE TEMP TABLE XPBuffer (id BIGINT, guildid BIGINT, xp BIGINT) ON COMMIT DROP;"
+                )
+                await conn.copy_records_to_table(
+                    "xpbuffer",
+                    records=[
+                        (id, guild_id, xp) for (guild_id, id), xp in batch.items()
+                    ],
+                )
+                await conn.execute(
+                    "INSERT INTO Users (id, guildid, xp) SELECT id, guildid, xp FROM XPBuffer "
+                    "ON CONFLICT (id, guildid) DO UPDATE SET xp = Users.xp + EXCLUDED.xp;"
+                )
+
+                for kind, table in PERIOD_TABLES.items():
+                    await conn.execute(
+                        f"INSERT INTO {table} (period, guildid, id, xp) SELECT $1, guildid, id, xp FROM XPBuffer "
+                        f"ON CONFLICT (period, guildid, id) DO UPDATE SET xp = {table}.xp + EXCLUDED.xp;",
+                        periods[kind],
+                    )
 
     async def fetch_user(self, id: int, guild_id: int, usecache: bool = True):
         return await self.fetchrow(
@@ -81,30 +371,283 @@ class Database:
             count,
         )
 
-    async def get_rank(self, id: int, guild_id: int):
-        return await self.fetchrow(
-            "SELECT rank FROM (SELECT id, RANK () OVER (ORDER BY xp DESC) FROM Users WHERE guildid = $1) as ranks WHERE id = $2;",
+    async def fetch_users_page(
+        self, guild_id: int, limit: int, after: Optional[Tuple[int, int]] = None
+    ) -> List[Tuple[int, int]]:
+        """Get a page of (id, xp) ordered by XP, starting after an (xp, id) position.
+
+        Pages are found by seeking the (guildid, xp, id) index, so deep pages
+        cost the same as the first one.
+        """
+        if after is None:
+            users = await self.fetch(
+                "SELECT id, xp FROM Users WHERE guildid = $1 "
+                "ORDER BY xp DESC, id DESC LIMIT $2;",
+                guild_id,
+                limit,
+            )
+        else:
+            users = await self.fetch(
+                "SELECT id, xp FROM Users WHERE guildid = $1 AND (xp, id) < ($2, $3) "
+                "ORDER BY xp DESC, id DESC LIMIT $4;",
+                guild_id,
+                *after,
+                limit,
+            )
+
+        return [(user["id"], user["xp"]) for user in users]
+
+    async def load_leaderboard(self, guild_id: int) -> TopK:
+        users = await self.fetch_top_users(guild_id, LEADERBOARD_SIZE)
+
+        return TopK(LEADERBOARD_SIZE, ((user["id"], user["xp"]) for user in users))
+
+    async def fetch_leaderboard(self, guild_id: int) -> TopK:
+        return await self.leaderboards.get(guild_id)
+
+    async def fetch_period_leaderboard(
+        self, guild_id: int, kind: str
+    ) -> List[Tuple[int, int]]:
+        """Get the (id, xp) of the top members by XP gained in the current week or month.
+
+        XP still in the write buffer is added on top of what's been written,
+        so nothing is flushed early to answer this.
+        """
+        table = PERIOD_TABLES[kind]
+        gains = self.buffer.get_guild(guild_id)
+
+        # Members with buffered XP are read too, they may overtake the written top
+        users = await self.buffer.consistent(
+            lambda: self.fetch(
+                f"(SELECT id, xp FROM {table} WHERE period = $1 AND guildid = $2 "
+                "ORDER BY xp DESC, id LIMIT $3) UNION "
+                f"(SELECT id, xp FROM {table} WHERE period = $1 AND guildid = $2 "
+                "AND id = ANY($4::BIGINT[]));",
+                self.current_periods()[kind],
+                guild_id,
+                LEADERBOARD_SIZE,
+                list(gains),
+            )
+        )
+
+        totals = {user["id"]: user["xp"] for user in users}
+        for id, xp in self.buffer.get_guild(guild_id).items():
+            totals[id] = totals.get(id, 0) + xp
+
+        return sorted(totals.items(), key=lambda user: (-user[1], user[0]))[
+            :LEADERBOARD_SIZE
+        ]
+
+    async def load_rank_index(self, guild_id: int) -> Optional[RankIndex]:
+        """Build a guild's rank index, or None if it has too many members for one."""
+        count = await self.fetchrow(
+            "SELECT COUNT(*) FROM Users WHERE guildid = $1;", guild_id
+        )
+        if count[0] > self.rank_index_limit:
+            return None
+
+        users = await self.fetch(
+            "SELECT id, xp FROM Users WHERE guildid = $1;",
             guild_id,
-            id,
         )
+        rows = [(user["id"], user["xp"]) for user in users]
+
+        # Building is pure Python, in a thread the gateway heartbeat still gets to run
+        return await get_running_loop().run_in_executor(None, RankIndex.from_rows, rows)
+
+    async def fetch_rank_index(self, guild_id: int) -> Optional[RankIndex]:
+        return await self.ranks.get(guild_id)
+
+    async def query_rank(
+        self, id: int, guild_id: int
+    ) -> Optional[Tuple[int, int, Optional[int]]]:
+        """Get a member's rank with SQL, counting the members above them on the xp index."""
+        user, pending = await self.fetch_user_pending(id, guild_id)
+        if not user and not pending:
+            return None
+
+        xp = (user["xp"] if user else 0) + pending
+        above = await self.fetchrow(
+            "SELECT COUNT(*), MIN(xp) FROM Users WHERE guildid = $1 AND xp > $2;",
+            guild_id,
+            xp,
+        )
+
+        return above[0] + 1, xp, above[1]
+
+    async def fetch_rank(
+        self, id: int, guild_id: int, indexed: bool = True
+    ) -> Optional[Tuple[int, int, Optional[int]]]:
+        """Get a member's rank, xp, and the xp of the closest member ranked above them.
+
+        The guild's rank index is used where it has one, otherwise the rank
+        is queried. Members with equal XP share a rank.
+        """
+        index = await self.fetch_rank_index(guild_id) if indexed else None
+        if index is None:
+            return await self.query_rank(id, guild_id)
+
+        xp = index.xp.get(id)
+        if xp is None:
+            return None
+
+        rank = index.rank(id)
+        # Everyone ranked above shares a higher score, the last of them is closest
+        ahead = index.at(rank - 2)[1] if rank > 1 else None
+
+        return rank, xp, ahead
+
+    async def load_bans(self):
+        """Load the ids of every banned user into memory."""
+        users = await self.fetch("SELECT id FROM BannedUsers;")
+
+        self.banned = {user["id"] for user in users}
+
+    async def reload_ban(self, id: int):
+        banned = await self.fetchrow(
+            "SELECT EXISTS (SELECT 1 FROM BannedUsers WHERE id = $1);", id
+        )
+
+        if banned[0]:
+            self.banned.add(id)
+        else:
+            self.banned.discard(id)
 
-    async def user_is_banned(self, id: int) -> bool:
+    async def publish_ban(self, id: int):
+        await self.execute("SELECT pg_notify('bans', $1);", str(id))
+        await self.reload_ban(id)
+
+    def is_banned(self, id: int, guild_id: Optional[int] = None) -> bool:
+        """Get whether a user, or the guild they're in, is banned."""
         if id in self.banned:
             return True
-        users = await self.fetch("SELECT * FROM Users WHERE id = $1;", id)
 
-        for user in users:
-            if user["banned"]:
-                self.banned.add(id)
-                return True
+        if guild_id is not None:
+            settings = self.settings.get(guild_id)
+            return bool(settings and settings.banned)
 
         return False
 
+    async def ban_user(self, id: int):
+        await self.execute(
+            "INSERT INTO BannedUsers (id) VALUES ($1) ON CONFLICT DO NOTHING;", id
+        )
+        await self.publish_ban(id)
+
+    async def unban_user(self, id: int):
+        await self.execute("DELETE FROM BannedUsers WHERE id = $1;", id)
+        await self.publish_ban(id)
+
+    async def set_guild_banned(self, id: int, banned: bool):
+        if banned:
+            await self.execute(
+                "INSERT INTO Guilds (id, banned) VALUES ($1, TRUE) "
+                "ON CONFLICT (id) DO UPDATE SET banned = TRUE;",
+                id,
+            )
+        else:
+            # An update only, unbanning a guild mustn't set it up
+            await self.execute("UPDATE Guilds SET banned = FALSE WHERE id = $1;", id)
+        await self.publish_guild(id)
+
+    async def fetch_api_key(self, token: str):
+        return await self.fetchrow("SELECT * FROM APIKeys WHERE token = $1;", token)
+
+    async def create_api_key(self, guild_id: int, permission: str = "fetch") -> str:
+        token = token_hex(32)
+        await self.execute(
+            "INSERT INTO APIKeys (guildid, token, permission) VALUES ($1, $2, $3);",
+            guild_id,
+            token,
+            permission,
+        )
+        return token
+
+    async def delete_api_key(self, token: str) -> bool:
+        deleted = await self.fetchrow(
+            "DELETE FROM APIKeys WHERE token = $1 RETURNING token;", token
+        )
+        return deleted is not None
+
+    def invalidate_users(self, guild_id: int):
+        """Drop cached user data for a guild after its rows are changed in bulk."""
+        self.xp_cache.invalidate(lambda key: key[0] == guild_id)
+        self.ranks.invalidate(guild_id)
+        self.leaderboards.invalidate(guild_id)
+
     async def clear_guild(self, id: int):
+        self.buffer.discard_guild(id)
         await self.execute("DELETE FROM Users WHERE guildid = $1;", id)
+        for table in PERIOD_TABLES.values():
+            await self.execute(f"DELETE FROM {table} WHERE guildid = $1;", id)
+        self.invalidate_users(id)
+
+    async def import_users(
+        self,
+        guild_id: int,
+        batches: AsyncIterator[List[Tuple[int, int]]],
+        replace: bool = False,
+    ) -> int:
+        """Atomically upsert a guild's XP from (id, xp) rows streamed in batches.
+
+        Rows are copied into a staging table as they arrive and only merged
+        once the iterator is exhausted, so a failure part way through leaves
+        the existing data untouched. With replace, members missing from the
+        import are removed.
+        """
+        count = 0
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "CREATE TEMP TABLE ImportUsers (id BIGINT NOT NULL, xp BIGINT NOT NULL) ON COMMIT DROP;"
+                )
+
+                async for batch in batches:
+                    await conn.copy_records_to_table("importusers", records=batch)
+                    count += len(batch)
+
+                if replace:
+                    await conn.execute(
+                        "DELETE FROM Users WHERE guildid = $1;", guild_id
+                    )
+                await conn.execute(
+                    "INSERT INTO Users (id, guildid, xp) "
+                    "SELECT DISTINCT ON (id) id, $1, xp FROM ImportUsers ORDER BY id, xp DESC "
+                    "ON CONFLICT (id, guildid) DO UPDATE SET xp = EXCLUDED.xp;",
+                    guild_id,
+                )
+
+        # Only once the swap has committed, a rollback has to keep the pending XP too
+        if replace:
+            self.buffer.discard_guild(guild_id)
+        self.invalidate_users(guild_id)
+        return count
+
+    async def export_users(self, guild_id: int, output: Callable[[bytes], Awaitable]):
+        """Stream a guild's XP as CSV to a coroutine function, chunk by chunk."""
+        await self.buffer.flush()
+
+        async with self.pool.acquire() as conn:
+            await conn.copy_from_query(
+                "SELECT id, xp FROM Users WHERE guildid = $1 ORDER BY xp DESC, id",
+                guild_id,
+                output=output,
+                format="csv",
+                header=True,
+            )
 
     async def add_users(self, users: list):
         async with self.pool.acquire() as conn:
             await conn.executemany(
                 "INSERT INTO Users VALUES ($1, $2, $3, $4, $5);", users
             )
+            # Rows flagged as banned are bans everywhere, as in migration 0006
+            await conn.executemany(
+                "INSERT INTO BannedUsers (id) VALUES ($1) ON CONFLICT DO NOTHING;",
+                [(user[0],) for user in users if user[4]],
+            )
+        await self.load_bans()
+
+        for guild_id in {user[1] for user in users}:
+            self.invalidate_users(guild_id)
@@ -5,3 +5,4 @@ ALGORITHM = "linear"
 LEVELUP = {"method": "react"}
 ROLES = {}
 DM_RANK = True
+DEFAULT = 30
@@ -0,0 +1,43 @@
+from csv import DictReader
+from gzip import GzipFile
+from io import BytesIO, TextIOWrapper
+from typing import Iterator, List, Tuple
+
+GZIP_MAGIC = b"\x1f\x8b"
+MAX_XP = 2**62
+
+
+class InvalidImport(ValueError):
+    """Raised when an uploaded XP file can't be imported."""
+
+
+def read_users(data: bytes, size: int) -> Iterator[List[Tuple[int, int]]]:
+    """Parse and validate an exported CSV file into batches of (id, xp) rows.
+
+    The file may be gzip compressed, and is decompressed as it's read.
+    """
+    raw = BytesIO(data)
+    if data.startswith(GZIP_MAGIC):
+        raw = GzipFile(fileobj=raw)
+
+    reader = DictReader(TextIOWrapper(raw, encoding="utf-8", newline=""))
+    if not reader.fieldnames or not {"id", "xp"} <= set(reader.fieldnames):
+        raise InvalidImport("The file must be a CSV with `id` and `xp` columns.")
+
+    batch = []
+    for row in reader:
+        try:
+            id, xp = int(row["id"]), int(row["xp"])
+        except (TypeError, ValueError):
+            raise InvalidImport(f"Line {reader.line_num} isn't a valid id and xp.")
+
+        if id <= 0 or not 0 <= xp <= MAX_XP:
+            raise InvalidImport(f"Line {reader.line_num} has an out of range value.")
+
+        batch.append((id, xp))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
@@ -0,0 +1,122 @@
+from asyncio import Task, create_task
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class GuildIndexes:
+    """In-memory per-guild indexes which are loaded lazily and dropped when idle.
+
+    Indexes must have a `set(id, xp)` method taking a member's total XP. XP
+    changes for a guild whose index is still loading are replayed onto it once
+    the load finishes, so nothing written during the load is lost.
+
+    `load` may return None for a guild which shouldn't be kept in memory, that
+    is remembered like an index so the guild isn't loaded again until it
+    expires. With `maxentries`, the indexes are also dropped once their total
+    length is above it.
+    """
+
+    def __init__(
+        self,
+        db,
+        load: Callable[[int], Awaitable[Any]],
+        idle: float,
+        maxsize: int,
+        maxentries: Optional[int] = None,
+    ):
+        self.db = db
+        self.load = load
+        self.idle = idle
+        self.maxsize = maxsize
+        self.maxentries = maxentries
+
+        # guild_id -> (last used, index), least recently used first
+        self.indexes: "OrderedDict[int, Tuple[float, Any]]" = OrderedDict()
+        self.loads: Dict[int, Task] = {}
+        # guild_id -> (id, xp) changes received while the guild was loading
+        self.pending: Dict[int, List[Tuple[int, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.indexes
+
+    @staticmethod
+    def length(index: Any) -> int:
+        return 0 if index is None else len(index)
+
+    def expire(self, now: float) -> None:
+        """Drop indexes which haven't been used recently, or are over the limits."""
+        entries = 0
+        if self.maxentries is not None:
+            entries = sum(self.length(index) for _, index in self.indexes.values())
+
+        while self.indexes:
+            guild_id, (used, index) = next(iter(self.indexes.items()))
+            if (
+                now - used < self.idle
+                and len(self.indexes) <= self.maxsize
+                and (self.maxentries is None or entries <= self.maxentries)
+            ):
+                break
+            del self.indexes[guild_id]
+            entries -= self.length(index)
+
+    async def get(self, guild_id: int) -> Any:
+        """Get a guild's index, loading it if it isn't in memory."""
+        now = monotonic()
+        self.expire(now)
+
+        entry = self.indexes.get(guild_id)
+        if entry is not None:
+            self.indexes[guild_id] = (now, entry[1])
+            self.indexes.move_to_end(guild_id)
+            return entry[1]
+
+        if guild_id not in self.loads:
+            self.loads[guild_id] = create_task(self._load(guild_id))
+
+        return await self.loads[guild_id]
+
+    async def _load(self, guild_id: int) -> Any:
+        self.pending[guild_id] = changes = []
+
+        try:
+            # Anything still in the write buffer has to be in the db before we read it
+            await self.db.buffer.flush()
+            index = await self.load(guild_id)
+        except BaseException:
+            # Only ours to drop if an invalidate hasn't replaced it
+            if self.pending.get(guild_id) is changes:
+                del self.pending[guild_id]
+            raise
+        finally:
+            del self.loads[guild_id]
+
+        # The guild was invalidated while loading, so what we read may be stale
+        if self.pending.get(guild_id) is not changes:
+            return index
+        del self.pending[guild_id]
+
+        if index is not None:
+            for id, xp in changes:
+                index.set(id, xp)
+
+        self.indexes[guild_id] = (monotonic(), index)
+        return index
+
+    def set(self, guild_id: int, id: int, xp: int) -> None:
+        """Record a member's new total XP in the guild's index, if it's loaded."""
+        entry = self.indexes.get(guild_id)
+        if entry is not None:
+            if entry[1] is not None:
+                entry[1].set(id, xp)
+        elif guild_id in self.pending:
+            self.pending[guild_id].append((id, xp))
+
+    def invalidate(self, guild_id: int) -> None:
+        """Drop a guild's index after its rows are changed in bulk."""
+        self.indexes.pop(guild_id, None)
+        self.pending.pop(guild_id, None)
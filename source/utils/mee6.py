@@ -0,0 +1,102 @@
+from aiohttp import ClientSession
+from asyncio import Queue, sleep
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from math import isfinite
+from typing import AsyncIterator, List, Optional, Tuple
+
+URL = "https://mee6.xyz/api/plugins/levels/leaderboard/{}"
+PAGE_SIZE = 1000
+RETRIES = 8
+
+
+class ImportFailed(Exception):
+    """Raised when the MEE6 leaderboard can't be fetched."""
+
+
+def retry_delay(retry_after: Optional[str], retries: int) -> float:
+    """Get how long to wait from a Retry-After header, in seconds or as an HTTP date.
+
+    Falls back to exponential backoff if the header is missing or invalid.
+    """
+    backoff = min(2**retries, 60)
+    if not retry_after:
+        return backoff
+
+    try:
+        seconds = float(retry_after)
+    except ValueError:
+        pass
+    else:
+        return max(seconds, 0) if isfinite(seconds) else backoff
+
+    try:
+        when = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError, IndexError):
+        return backoff
+
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+async def fetch_pages(
+    session: ClientSession, guild: int, queue: "Queue[Optional[List[Tuple[int, int]]]]"
+) -> None:
+    """Put each page of a guild's MEE6 leaderboard into a queue as (id, xp) rows.
+
+    None is put into the queue once every page has been fetched, or if
+    fetching fails, so that the consumer stops.
+    """
+    page = 0
+    retries = 0
+
+    try:
+        while True:
+            async with session.get(
+                URL.format(guild), params={"page": page, "limit": PAGE_SIZE}
+            ) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    retries += 1
+                    if retries > RETRIES:
+                        raise ImportFailed(
+                            f"MEE6 returned {resp.status} too many times"
+                        )
+
+                    await sleep(retry_delay(resp.headers.get("Retry-After"), retries))
+                    continue
+
+                if resp.status >= 400:
+                    raise ImportFailed(f"MEE6 returned {resp.status} for page {page}")
+
+                data = await resp.json()
+
+            retries = 0
+            players = data["players"]
+            if not players:
+                break
+
+            await queue.put([(int(player["id"]), player["xp"]) for player in players])
+            page += 1
+    except Exception:
+        await queue.put(None)
+        raise
+
+    await queue.put(None)
+
+
+async def batches(
+    queue: "Queue[Optional[List[Tuple[int, int]]]]", size: int
+) -> AsyncIterator[List[Tuple[int, int]]]:
+    """Regroup the pages from a queue into batches of at least `size` rows."""
+    batch = []
+
+    while (page := await queue.get()) is not None:
+        batch.extend(page)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
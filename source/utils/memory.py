@@ -0,0 +1,514 @@
+from asyncio import Task, create_task, get_running_loop, sleep
+from datetime import date
+from json import dumps, loads
+from os import fsync, getenv
+from secrets import token_hex
+from pathlib import Path
+from traceback import print_exc
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+)
+
+from helpers.leaderboard import TopK
+from helpers.periods import retention_cutoff
+from helpers.ranking import RankIndex
+
+from .database import LEADERBOARD_SIZE, Database
+from .settings import GuildSettings
+
+EXPORT_CHUNK = 10_000
+
+
+class MemoryDatabase(Database):
+    """A single process database backend which keeps everything in memory.
+
+    Every change is applied in memory and appended to a journal, and the whole
+    state is periodically written out as a snapshot. On startup the latest
+    snapshot is loaded and the journal is replayed on top of it. Journal
+    entries are numbered so anything the snapshot already has is skipped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.path = Path(getenv("MEMORY_PATH", "data"))
+        self.interval = float(getenv("MEMORY_SNAPSHOT_INTERVAL", 300))
+
+        # guild_id -> (prefix, config, banned)
+        self.guilds: Dict[int, Tuple[str, dict, bool]] = {}
+        # guild_id -> id -> xp
+        self.users: Dict[int, Dict[int, int]] = {}
+        # ids of users banned everywhere
+        self.user_bans: Set[int] = set()
+        # token -> (guild_id, permission)
+        self.api_keys: Dict[str, Tuple[int, str]] = {}
+        # (kind, first day of the period) -> guild_id -> id -> xp gained in it
+        self.windows: Dict[Tuple[str, str], Dict[int, Dict[int, int]]] = {}
+
+        self.seq = 0
+        self.journal: Optional[TextIO] = None
+        self.snapshots: Optional[Task] = None
+
+    async def setup(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.restore()
+
+        self.journal = self.open_journal()
+        self.snapshots = create_task(self.run_snapshots())
+
+        await self.load_guilds()
+        await self.load_bans()
+
+        self.buffer.start()
+        self.ready.set()
+
+    async def close(self):
+        if not self.journal:
+            return
+
+        self.snapshots.cancel()
+        await self.buffer.close()
+        await self.snapshot()
+        self.journal.close()
+        self.journal = None
+
+    # Persistence
+
+    def restore(self) -> None:
+        """Load the latest snapshot, then replay every newer journal entry."""
+        snapshot = self.path / "snapshot.json"
+        if snapshot.exists():
+            state = loads(snapshot.read_text())
+            self.seq = state["seq"]
+            self.guilds = {id: tuple(row) for id, *row in state["guilds"]}
+            for guild_id, users in state["users"]:
+                self.users[guild_id] = {id: xp for id, xp in users}
+            self.user_bans = set(state.get("user_bans", []))
+            for token, guild_id, permission in state.get("api_keys", []):
+                self.api_keys[token] = (guild_id, permission)
+            for kind, start, guilds in state.get("windows", []):
+                self.windows[kind, start] = {
+                    guild_id: dict(users) for guild_id, users in guilds
+                }
+
+        for journal in sorted(self.path.glob("journal.*.jsonl")):
+            with journal.open() as f:
+                for line in f:
+                    # The last line may be partly written if the process died
+                    try:
+                        seq, op, *args = loads(line)
+                    except ValueError:
+                        break
+
+                    if seq > self.seq:
+                        self.seq = seq
+                        self.apply(op, *args)
+
+    def open_journal(self) -> TextIO:
+        return (self.path / f"journal.{self.seq + 1:020}.jsonl").open("a")
+
+    def log(self, op: str, *args: Any) -> None:
+        """Apply a change and append it to the journal."""
+        self.apply(op, *args)
+
+        self.seq += 1
+        self.journal.write(dumps([self.seq, op, *args]) + "\n")
+        self.journal.flush()
+
+    async def snapshot(self) -> None:
+        """Write the whole state to disk, then drop the journals it covers."""
+        seq = self.seq
+        state = dumps(
+            {
+                "seq": seq,
+                "guilds": [[id, *row] for id, row in self.guilds.items()],
+                "users": [
+                    [guild_id, list(users.items())]
+                    for guild_id, users in self.users.items()
+                ],
+                "user_bans": list(self.user_bans),
+                "api_keys": [[token, *key] for token, key in self.api_keys.items()],
+                "windows": [
+                    [
+                        kind,
+                        start,
+                        [
+                            [guild_id, list(users.items())]
+                            for guild_id, users in guilds.items()
+                        ],
+                    ]
+                    for (kind, start), guilds in self.windows.items()
+                ],
+            }
+        )
+
+        # Newer changes go into a new journal while the snapshot is written
+        old, self.journal = self.journal, self.open_journal()
+        old.close()
+
+        await get_running_loop().run_in_executor(None, self.write_snapshot, state)
+
+        for journal in self.path.glob("journal.*.jsonl"):
+            if int(journal.stem.split(".")[1]) <= seq:
+                journal.unlink()
+
+    def write_snapshot(self, state: str) -> None:
+        temp = self.path / "snapshot.json.tmp"
+        with temp.open("w") as f:
+            f.write(state)
+            f.flush()
+            fsync(f.fileno())
+
+        temp.replace(self.path / "snapshot.json")
+
+    async def run_snapshots(self) -> None:
+        while True:
+            await sleep(self.interval)
+            try:
+                await self.snapshot()
+            except Exception:
+                print_exc()
+
+    def apply(self, op: str, *args: Any) -> None:
+        """Apply a single journalled change to the in-memory state."""
+        if op == "guild":
+            id, prefix, config, banned = args
+            # Journals written before configs were dicts hold them as JSON text
+            if isinstance(config, str):
+                config = loads(config)
+            self.guilds[id] = (prefix, config, banned)
+        elif op == "xp":
+            rows, periods = args[0], args[1] if len(args) > 1 else {}
+            for guild_id, id, xp in rows:
+                users = self.users.setdefault(guild_id, {})
+                users[id] = users.get(id, 0) + xp
+
+            for kind, start in periods.items():
+                window = self.windows.setdefault((kind, start), {})
+                for guild_id, id, xp in rows:
+                    users = window.setdefault(guild_id, {})
+                    users[id] = users.get(id, 0) + xp
+
+                # Past periods are retired whole once they fall out of retention
+                cutoff = retention_cutoff(
+                    kind, date.fromisoformat(start), self.retention
+                ).isoformat()
+                for key in [key for key in self.windows if key[0] == kind]:
+                    if key[1] < cutoff:
+                        del self.windows[key]
+        elif op == "ban":
+            self.user_bans.add(args[0])
+        elif op == "unban":
+            self.user_bans.discard(args[0])
+        elif op == "clear":
+            self.users.pop(args[0], None)
+            for window in self.windows.values():
+                window.pop(args[0], None)
+        elif op == "import":
+            guild_id, replace, rows = args
+            users = self.users.setdefault(guild_id, {})
+            if replace:
+                users.clear()
+            users.update(rows)
+        elif op == "apikey":
+            token, guild_id, permission = args
+            if guild_id is None:
+                self.api_keys.pop(token, None)
+            else:
+                self.api_keys[token] = (guild_id, permission)
+        elif op == "users":
+            for id, guild_id, xp, _, banned in args[0]:
+                self.users.setdefault(guild_id, {})[id] = xp
+                # Rows flagged as banned are bans everywhere, as in migration 0006
+                if banned:
+                    self.user_bans.add(id)
+
+    # Guilds
+
+    def guild_record(self, id: int) -> Optional[dict]:
+        row = self.guilds.get(id)
+        if row is None:
+            return None
+
+        prefix, config, banned = row
+        return {"id": id, "prefix": prefix, "config": config, "banned": banned}
+
+    async def load_guilds(self):
+        self.settings = {
+            id: GuildSettings.from_record(self.guild_record(id)) for id in self.guilds
+        }
+
+    async def reload_guild(self, id: int):
+        guild = self.guild_record(id)
+
+        if guild:
+            self.settings[id] = GuildSettings.from_record(guild)
+        else:
+            self.settings.pop(id, None)
+
+    async def publish_guild(self, id: int):
+        await self.reload_guild(id)
+
+    async def create_guild(self, id: int, prefix: str = "!", config: dict = {}):
+        self.log("guild", id, prefix, config, False)
+        await self.publish_guild(id)
+
+    async def update_guild_prefix(self, id: int, prefix: str):
+        _, config, banned = self.guilds.get(id, ("!", {}, False))
+        self.log("guild", id, prefix, config, banned)
+        await self.publish_guild(id)
+
+    async def update_guild_config(self, id: int, config: dict):
+        prefix, _, banned = self.guilds.get(id, ("!", {}, False))
+        self.log("guild", id, prefix, config, banned)
+        await self.publish_guild(id)
+
+    async def set_guild_config(self, id: int, values: dict):
+        prefix, config, banned = self.guilds.get(id, ("!", {}, False))
+        self.log("guild", id, prefix, {**config, **values}, banned)
+        await self.publish_guild(id)
+
+    async def set_guild_config_item(self, id: int, key: str, item: str, value):
+        prefix, config, banned = self.guilds.get(id, ("!", {}, False))
+        config = {**config, key: {**config.get(key, {}), item: value}}
+        self.log("guild", id, prefix, config, banned)
+        await self.publish_guild(id)
+
+    async def delete_guild_config(self, id: int, *path: str):
+        if id not in self.guilds:
+            return
+
+        prefix, config, banned = self.guilds[id]
+        self.log("guild", id, prefix, _without(config, path), banned)
+        await self.publish_guild(id)
+
+    async def fetch_guilds_with_config(self, config: dict) -> List[int]:
+        return [
+            id for id, (_, value, _) in self.guilds.items() if _contains(value, config)
+        ]
+
+    async def fetch_guild(self, id: int):
+        return self.guild_record(id)
+
+    async def set_guild_banned(self, id: int, banned: bool):
+        if not banned and id not in self.guilds:
+            return
+
+        prefix, config, _ = self.guilds.get(id, ("!", {}, False))
+        self.log("guild", id, prefix, config, banned)
+        await self.publish_guild(id)
+
+    # Users
+
+    async def flush_xp(self, batch: dict):
+        periods = {
+            kind: start.isoformat() for kind, start in self.current_periods().items()
+        }
+        self.log(
+            "xp",
+            [[guild_id, id, xp] for (guild_id, id), xp in batch.items()],
+            periods,
+        )
+
+    async def fetch_user(self, id: int, guild_id: int, usecache: bool = True):
+        xp = self.users.get(guild_id, {}).get(id)
+        if xp is None:
+            return None
+
+        return {
+            "id": id,
+            "guildid": guild_id,
+            "xp": xp,
+            "monthly_xp": 0,
+            "banned": False,
+        }
+
+    async def fetch_top_users(self, guild_id: int, count: int = 15):
+        users = sorted(
+            self.users.get(guild_id, {}).items(),
+            key=lambda user: (-user[1], user[0]),
+        )[:count]
+
+        return [await self.fetch_user(id, guild_id) for id, _ in users]
+
+    async def load_leaderboard(self, guild_id: int) -> TopK:
+        users = sorted(
+            self.users.get(guild_id, {}).items(),
+            key=lambda user: (-user[1], user[0]),
+        )[:LEADERBOARD_SIZE]
+
+        return TopK(LEADERBOARD_SIZE, users)
+
+    async def fetch_period_leaderboard(
+        self, guild_id: int, kind: str
+    ) -> List[Tuple[int, int]]:
+        start = self.current_periods()[kind].isoformat()
+        totals = dict(self.windows.get((kind, start), {}).get(guild_id, {}))
+        for id, xp in self.buffer.get_guild(guild_id).items():
+            totals[id] = totals.get(id, 0) + xp
+
+        return sorted(totals.items(), key=lambda user: (-user[1], user[0]))[
+            :LEADERBOARD_SIZE
+        ]
+
+    async def fetch_users_page(
+        self, guild_id: int, limit: int, after: Optional[Tuple[int, int]] = None
+    ) -> List[Tuple[int, int]]:
+        users = sorted(
+            self.users.get(guild_id, {}).items(),
+            key=lambda user: (user[1], user[0]),
+            reverse=True,
+        )
+        if after is not None:
+            users = [(id, xp) for id, xp in users if (xp, id) < after]
+
+        return users[:limit]
+
+    async def load_rank_index(self, guild_id: int) -> Optional[RankIndex]:
+        users = self.users.get(guild_id, {})
+        if len(users) > self.rank_index_limit:
+            return None
+
+        return await get_running_loop().run_in_executor(
+            None, RankIndex.from_rows, list(users.items())
+        )
+
+    async def query_rank(
+        self, id: int, guild_id: int
+    ) -> Optional[Tuple[int, int, Optional[int]]]:
+        user, pending = await self.fetch_user_pending(id, guild_id)
+        if not user and not pending:
+            return None
+
+        xp = (user["xp"] if user else 0) + pending
+        above = [other for other in self.users.get(guild_id, {}).values() if other > xp]
+
+        return len(above) + 1, xp, min(above, default=None)
+
+    # Bans
+
+    async def load_bans(self):
+        self.banned = set(self.user_bans)
+
+    async def reload_ban(self, id: int):
+        if id in self.user_bans:
+            self.banned.add(id)
+        else:
+            self.banned.discard(id)
+
+    async def publish_ban(self, id: int):
+        await self.reload_ban(id)
+
+    async def ban_user(self, id: int):
+        self.log("ban", id)
+        await self.publish_ban(id)
+
+    async def unban_user(self, id: int):
+        self.log("unban", id)
+        await self.publish_ban(id)
+
+    # API keys
+
+    async def fetch_api_key(self, token: str):
+        key = self.api_keys.get(token)
+        if key is None:
+            return None
+
+        guild_id, permission = key
+        return {"guildid": guild_id, "token": token, "permission": permission}
+
+    async def create_api_key(self, guild_id: int, permission: str = "fetch") -> str:
+        token = token_hex(32)
+        self.log("apikey", token, guild_id, permission)
+        return token
+
+    async def delete_api_key(self, token: str) -> bool:
+        if token not in self.api_keys:
+            return False
+
+        self.log("apikey", token, None, None)
+        return True
+
+    # Bulk changes
+
+    async def clear_guild(self, id: int):
+        self.buffer.discard_guild(id)
+        self.log("clear", id)
+        self.invalidate_users(id)
+
+    async def import_users(
+        self,
+        guild_id: int,
+        batches: AsyncIterator[List[Tuple[int, int]]],
+        replace: bool = False,
+    ) -> int:
+        # Staged until the iterator is exhausted, so failures change nothing
+        staged: Dict[int, int] = {}
+        count = 0
+
+        async for batch in batches:
+            for id, xp in batch:
+                staged[id] = max(xp, staged.get(id, xp))
+            count += len(batch)
+
+        self.log("import", guild_id, replace, list(staged.items()))
+        if replace:
+            self.buffer.discard_guild(guild_id)
+
+        self.invalidate_users(guild_id)
+        return count
+
+    async def export_users(self, guild_id: int, output: Callable[[bytes], Awaitable]):
+        await self.buffer.flush()
+
+        users = sorted(
+            self.users.get(guild_id, {}).items(),
+            key=lambda user: (-user[1], user[0]),
+        )
+
+        await output(b"id,xp\n")
+        for i in range(0, len(users), EXPORT_CHUNK):
+            chunk = users[i : i + EXPORT_CHUNK]
+            await output("".join(f"{id},{xp}\n" for id, xp in chunk).encode())
+
+    async def add_users(self, users: list):
+        self.log("users", [list(user) for user in users])
+        await self.load_bans()
+
+        for guild_id in {user[1] for user in users}:
+            self.invalidate_users(guild_id)
+
+
+def _without(config: dict, path: Tuple[str, ...]) -> dict:
+    """Copy a config without the value at a path, like jsonb's #- operator."""
+    if not path or not isinstance(config, dict) or path[0] not in config:
+        return config
+
+    key, *rest = path
+    if not rest:
+        return {k: v for k, v in config.items() if k != key}
+
+    return {**config, key: _without(config[key], tuple(rest))}
+
+
+def _contains(value: Any, query: Any) -> bool:
+    """Check whether a JSON value contains another, like jsonb's @> operator."""
+    if isinstance(query, dict):
+        return isinstance(value, dict) and all(
+            key in value and _contains(value[key], item) for key, item in query.items()
+        )
+
+    if isinstance(query, list):
+        return isinstance(value, list) and all(
+            any(_contains(element, item) for element in value) for item in query
+        )
+
+    return value == query
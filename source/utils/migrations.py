@@ -0,0 +1,100 @@
+from asyncpg import Connection
+from pathlib import Path
+from re import IGNORECASE, compile
+from typing import List, Optional
+
+MIGRATIONS = Path(__file__).parents[2] / "static" / "migrations"
+
+# Held while migrating so only one bot process applies migrations at a time
+LOCK = 0x4D41454C
+
+# Statements like CREATE INDEX CONCURRENTLY can't run inside a transaction,
+# migrations starting with this marker run without one and must only contain
+# a single statement so that Postgres doesn't wrap them in one implicitly
+NO_TRANSACTION = "-- no-transaction"
+
+CONCURRENT_INDEX = compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+    IGNORECASE,
+)
+
+
+async def drop_invalid_index(conn: Connection, sql: str) -> Optional[str]:
+    """Drop the index a migration builds concurrently if an earlier build left it invalid.
+
+    A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind, which
+    IF NOT EXISTS would then skip over.
+    """
+    match = CONCURRENT_INDEX.search(sql)
+    if not match:
+        return None
+
+    name = match.group(1)
+    invalid = await conn.fetchval(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1);",
+        name,
+    )
+    if not invalid:
+        return None
+
+    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+    return name
+
+
+async def migrate(conn: Connection) -> List[str]:
+    """Apply every migration which hasn't been applied yet, in order."""
+    applied = []
+
+    await conn.execute("SELECT pg_advisory_lock($1);", LOCK)
+    try:
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS SchemaMigrations ("
+            "version INT NOT NULL PRIMARY KEY, "
+            "name TEXT NOT NULL, "
+            "applied_at TIMESTAMPTZ NOT NULL DEFAULT now());"
+        )
+        versions = {
+            row["version"]
+            for row in await conn.fetch("SELECT version FROM SchemaMigrations;")
+        }
+
+        for path in sorted(MIGRATIONS.glob("*.sql")):
+            version = int(path.stem.split("_", 1)[0])
+            sql = path.read_text()
+
+            if version in versions:
+                # Migrations recorded before invalid indexes were checked for are rebuilt
+                if sql.startswith(NO_TRANSACTION) and await drop_invalid_index(
+                    conn, sql
+                ):
+                    await conn.execute(sql)
+                    applied.append(path.stem)
+                continue
+
+            if sql.startswith(NO_TRANSACTION):
+                await drop_invalid_index(conn, sql)
+                await conn.execute(sql)
+
+                # A build which failed and left an invalid index raises here, not silently
+                if await drop_invalid_index(conn, sql):
+                    raise RuntimeError(f"Migration {path.stem} built an invalid index")
+
+                await conn.execute(
+                    "INSERT INTO SchemaMigrations (version, name) VALUES ($1, $2);",
+                    version,
+                    path.stem,
+                )
+            else:
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO SchemaMigrations (version, name) VALUES ($1, $2);",
+                        version,
+                        path.stem,
+                    )
+
+            applied.append(path.stem)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1);", LOCK)
+
+    return applied
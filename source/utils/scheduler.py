@@ -0,0 +1,114 @@
+from asyncio import Event, Task, create_task
+from heapq import heappop, heappush
+from itertools import count
+from os import getenv
+from traceback import print_exc
+from typing import Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+Factory = Callable[[], Awaitable]
+
+
+class RESTScheduler:
+    """A background dispatcher for REST calls which shouldn't block event handlers.
+
+    Jobs are grouped into per-route queues, and a route only ever has one job
+    in flight so a slow or ratelimited route can't take up every worker. The
+    next job is always the highest priority one across every idle route.
+    Submitting a job with the key of one that's still queued replaces it, so
+    superseded work collapses into the latest version.
+    """
+
+    ROLES = 0
+    LEVELUP = 1
+
+    def __init__(self):
+        self.concurrency = int(getenv("REST_CONCURRENCY", 8))
+        self.maxsize = int(getenv("REST_QUEUE_SIZE", 10_000))
+
+        # key -> (route, factory) for every queued job
+        self.jobs: Dict[Hashable, Tuple[Hashable, Factory]] = {}
+        # route -> heap of (priority, seq, key)
+        self.routes: Dict[Hashable, List[Tuple[int, int, Hashable]]] = {}
+        # heap of (priority, seq, route) for routes which might be runnable
+        self.ready: List[Tuple[int, int, Hashable]] = []
+        self.busy: Set[Hashable] = set()
+
+        self.seq = count()
+        self.wakeup = Event()
+        self.workers: List[Task] = []
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def start(self) -> None:
+        """Start the worker tasks."""
+        if not self.workers:
+            self.workers = [create_task(self.work()) for _ in range(self.concurrency)]
+
+    async def close(self) -> None:
+        """Stop the workers, dropping anything still queued."""
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def submit(
+        self, key: Hashable, route: Hashable, priority: int, factory: Factory
+    ) -> None:
+        """Queue a job, replacing any queued job with the same key."""
+        if key in self.jobs:
+            self.jobs[key] = (self.jobs[key][0], factory)
+            self.coalesced += 1
+            return
+
+        if len(self.jobs) >= self.maxsize:
+            self.dropped += 1
+            return
+
+        self.jobs[key] = (route, factory)
+
+        seq = next(self.seq)
+        heappush(self.routes.setdefault(route, []), (priority, seq, key))
+        if route not in self.busy:
+            heappush(self.ready, (priority, seq, route))
+            self.wakeup.set()
+
+    def next(self) -> Tuple[Hashable, Hashable]:
+        """Pop the highest priority job from an idle route."""
+        while self.ready:
+            _, _, route = heappop(self.ready)
+
+            # Routes can be pushed more than once, skip the stale entries
+            if route in self.busy or not self.routes.get(route):
+                continue
+
+            _, _, key = heappop(self.routes[route])
+            return route, key
+
+        return None, None
+
+    async def work(self) -> None:
+        while True:
+            route, key = self.next()
+            if key is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            _, factory = self.jobs.pop(key)
+            self.busy.add(route)
+
+            try:
+                await factory()
+            except Exception:
+                print_exc()
+            finally:
+                self.busy.discard(route)
+
+                queue = self.routes.get(route)
+                if queue:
+                    heappush(self.ready, (queue[0][0], queue[0][1], route))
+                    self.wakeup.set()
+                else:
+                    self.routes.pop(route, None)
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from functools import cached_property
+from itertools import count
+from json import loads
+from types import MappingProxyType
+from typing import Mapping
+
+from helpers.curves import Curve, get_curve
+from helpers.roles import LevelRoles
+
+from .defaults import (
+    DEFAULT,
+    INCREMENT,
+    MODIFIERS,
+    COOLDOWN,
+    ALGORITHM,
+    LEVELUP,
+    ROLES,
+    DM_RANK,
+)
+
+_versions = count(1)
+
+
+@dataclass(frozen=True)
+class GuildSettings:
+    """An immutable, fully defaulted view of a guild's settings."""
+
+    id: int
+    version: int
+    prefix: str
+    banned: bool
+    config: Mapping
+    algorithm_name: str
+    curve: Curve
+    default: int
+    increment: int
+    cooldown: int
+    modifiers: Mapping[int, float]
+    roles: Mapping[int, int]
+    levelup: Mapping
+    dm_rank: bool
+
+    @classmethod
+    def from_record(cls, record) -> "GuildSettings":
+        """Parse a Guilds row, with its config as a dict or JSON text, into a settings object."""
+        config = record["config"]
+        if isinstance(config, str):
+            config = loads(config)
+        algorithm = config.get("algorithm", ALGORITHM)
+        increment = config.get("increment", INCREMENT)
+        steps = tuple(sorted((int(k), v) for k, v in config.get("steps", {}).items()))
+
+        return cls(
+            id=record["id"],
+            version=next(_versions),
+            prefix=record["prefix"],
+            banned=record["banned"],
+            config=MappingProxyType(config),
+            algorithm_name=algorithm,
+            curve=get_curve(algorithm, increment, steps),
+            default=config.get("default", DEFAULT),
+            increment=increment,
+            cooldown=config.get("cooldown", COOLDOWN),
+            modifiers=MappingProxyType(
+                {int(k): v for k, v in config.get("modifiers", MODIFIERS).items()}
+            ),
+            roles=MappingProxyType(
+                {int(k): v for k, v in config.get("roles", ROLES).items()}
+            ),
+            levelup=MappingProxyType(config.get("levelup", LEVELUP)),
+            dm_rank=config.get("dm_rank", DM_RANK),
+        )
+
+    @cached_property
+    def level_roles(self) -> LevelRoles:
+        """The level roles compiled for bisect lookups."""
+        return LevelRoles(self.roles)
+
+    @classmethod
+    def empty(cls, id: int) -> "GuildSettings":
+        """Get the default settings for a guild which isn't set up."""
+        return cls.from_record({"id": id, "prefix": "!", "banned": False, "config": {}})
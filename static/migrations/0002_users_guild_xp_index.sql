@@ -0,0 +1,2 @@
+-- no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_guildid_xp_idx ON Users (guildid, xp DESC, id DESC);
@@ -0,0 +1,2 @@
+-- no-transaction
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_banned_idx ON Users (id) WHERE banned;
@@ -0,0 +1,5 @@
+ALTER TABLE Guilds ALTER COLUMN config DROP DEFAULT;
+ALTER TABLE Guilds ALTER COLUMN config TYPE JSONB USING config::jsonb;
+ALTER TABLE Guilds ALTER COLUMN config SET DEFAULT '{}';
+
+CREATE INDEX IF NOT EXISTS guilds_config_idx ON Guilds USING GIN (config jsonb_path_ops);
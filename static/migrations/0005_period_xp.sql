@@ -0,0 +1,18 @@
+CREATE TABLE IF NOT EXISTS WeeklyXP (
+    period          DATE NOT NULL,
+    guildid         BIGINT NOT NULL,
+    id              BIGINT NOT NULL,
+    xp              BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, guildid, id)
+) PARTITION BY RANGE (period);
+
+CREATE TABLE IF NOT EXISTS MonthlyXP (
+    period          DATE NOT NULL,
+    guildid         BIGINT NOT NULL,
+    id              BIGINT NOT NULL,
+    xp              BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, guildid, id)
+) PARTITION BY RANGE (period);
+
+CREATE INDEX IF NOT EXISTS weeklyxp_guildid_xp_idx ON WeeklyXP (guildid, period, xp DESC);
+CREATE INDEX IF NOT EXISTS monthlyxp_guildid_xp_idx ON MonthlyXP (guildid, period, xp DESC);
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS BannedUsers (
+    id              BIGINT NOT NULL PRIMARY KEY
+);
+
+-- Bans used to be a flag on any one of the user's rows, and always applied everywhere
+INSERT INTO BannedUsers (id) SELECT DISTINCT id FROM Users WHERE banned ON CONFLICT DO NOTHING;
+
+-- The rows the ban command created just to hold the flag
+DELETE FROM Users WHERE banned AND xp = 0;
+UPDATE Users SET banned = FALSE WHERE banned;
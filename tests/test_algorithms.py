@@ -0,0 +1,74 @@
+from random import Random
+
+import numpy as np
+import pytest
+
+from helpers.algorithms import BATCH_MAX_XP, Linear, Quadratic, _too_large
+
+ALGORITHMS = [Linear, Quadratic]
+INCREMENTS = [1, 7, 300, 1000, 12345]
+
+
+def assert_agrees(algorithm, xp, inc):
+    levels, required = algorithm.get_levels(xp, inc)
+
+    assert [(int(level), int(req)) for level, req in zip(levels, required)] == [
+        algorithm.get_level(value, inc) for value in xp
+    ]
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+@pytest.mark.parametrize("inc", INCREMENTS)
+def test_random_xp(algorithm, inc):
+    rng = Random(inc)
+    xp = [rng.randrange(10 ** rng.randint(1, 17)) for _ in range(5000)]
+
+    assert_agrees(algorithm, xp, inc)
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+@pytest.mark.parametrize("inc", INCREMENTS)
+def test_small_xp(algorithm, inc):
+    assert_agrees(algorithm, list(range(5 * inc + 100)), inc)
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+@pytest.mark.parametrize("inc", INCREMENTS)
+def test_level_boundaries(algorithm, inc):
+    # Either side of the first levels, where float rounding would show up first
+    xp = []
+    for level in range(1, 200):
+        threshold = inc * level * (level + 1) // 2
+        xp.extend([threshold - 1, threshold, threshold + 1, inc * level - 1])
+
+    assert_agrees(algorithm, [value for value in xp if value >= 0], inc)
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+@pytest.mark.parametrize("inc", INCREMENTS)
+def test_batch_max_boundary(algorithm, inc):
+    below = [BATCH_MAX_XP - 2, BATCH_MAX_XP - 1]
+
+    assert not _too_large(below)
+    assert algorithm.get_levels(below, inc)[0].dtype == np.int64
+    assert_agrees(algorithm, below, inc)
+
+    assert _too_large(below + [BATCH_MAX_XP])
+    assert_agrees(algorithm, below + [BATCH_MAX_XP, BATCH_MAX_XP + 1], inc)
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+@pytest.mark.parametrize("inc", INCREMENTS)
+def test_object_fallback(algorithm, inc):
+    # Past int64 entirely, only Python ints can hold these
+    xp = [0, 10**20, 2**63, 2**64 + 12345, 10**30]
+
+    assert _too_large(xp)
+    levels, _ = algorithm.get_levels(xp, inc)
+    assert levels.dtype == object
+    assert_agrees(algorithm, xp, inc)
+
+
+def test_too_large_empty():
+    assert not _too_large([])
+    assert not _too_large(np.array([], dtype=np.int64))
@@ -0,0 +1,34 @@
+from random import Random
+
+import pytest
+
+from helpers.curves import get_curve
+
+CURVES = [
+    ("exponential", 300, ()),
+    ("mee6", 300, ()),
+    ("piecewise", 300, ((0, 100), (10, 500), (50, 2000))),
+]
+
+
+def assert_agrees(curve, xp):
+    levels, required = curve.get_levels(xp)
+
+    assert [(int(level), int(req)) for level, req in zip(levels, required)] == [
+        curve.get_level(value) for value in xp
+    ]
+
+
+@pytest.mark.parametrize("name, inc, steps", CURVES)
+def test_random_xp(name, inc, steps):
+    rng = Random(0)
+    xp = [rng.randrange(10 ** rng.randint(1, 12)) for _ in range(2000)]
+
+    assert_agrees(get_curve(name, inc, steps), xp)
+
+
+def test_huge_step_cost():
+    # Costs past int64 used to overflow converting the table to an array
+    curve = get_curve("piecewise", 300, ((0, 10**20),))
+
+    assert_agrees(curve, [0, 5, 10**20, 10**21, 2**62])